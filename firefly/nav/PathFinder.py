@@ -1,6 +1,16 @@
 from typing import Tuple, List, Optional, Dict
+import heapq
+import math
 import numpy as np
-from collections import deque
+
+from . import alternatives
+from . import distance_field
+from . import fire_risk
+
+# 8-connected moves, in the order _bfs expands the children of a cell
+MOVES = ((0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (1, 1), (-1, 1), (1, -1))
+# length of each move in cells, diagonals are sqrt(2)
+MOVE_COSTS = tuple(math.hypot(dx, dy) for dx, dy in MOVES)
 
 def is_valid(grid, coordinates):
     x, y = coordinates
@@ -12,60 +22,354 @@ def is_safe(grid, coordinates, fire):
         return False
     return True
 
-def _get_path(parent, goal):
+def padded_mask(grid, fire=None):
+    '''
+    Flattened passable mask with a one cell wall border, so that the
+    neighbours of a flat index i are always i + move_offsets(cols)
+    '''
+    passable = np.asarray(grid) != 0
+    if fire is not None:
+        passable &= np.asarray(fire) != 1
+    return np.pad(passable, 1, constant_values=False).ravel()
+
+def move_offsets(cols):
+    width = cols + 2
+    return np.array([dx*width + dy for dx, dy in MOVES], dtype=np.int32)
+
+def to_index(coordinates, shape):
+    x, y = coordinates
+    return (x + 1)*(shape[1] + 2) + y + 1
+
+def to_coordinates(index, shape):
+    x, y = divmod(int(index), shape[1] + 2)
+    return (x - 1, y - 1)
+
+def _get_path(parent, goal, shape):
     path = []
-    while goal:
-        path.append(goal)
-        goal = parent.get(goal, None)
+    while goal >= 0:
+        path.append(to_coordinates(goal, shape))
+        goal = parent[goal]
     return path[::-1]
 
-def _path_shortner(path):
-    if len(path) <= 3:
-        return path
-    i = 2
-    while i < len(path)-1:
-        while i < len(path)-1 and path[i][0] == path[i-2][0] and path[i][0] == path[i-1][0]:
-            path.pop(i-1)
-        while i < len(path)-1 and path[i][1] == path[i-2][1] and path[i][1] == path[i-1][1]:
-            path.pop(i-1)
-        i += 1
-    return path
-
-def _bfs(grid=None, goal_nodes=None, entry=(3, 25), fire=None):
-    q = deque([entry])
-    q.append(entry)
-    visited = set([entry])
-    parent = {}
+def line_of_sight(passable, start, ends):
+    '''
+    Checks the straight segments from start to each of ends against a 2D passable mask
+    The cells of every segment are rasterized at once (Bresenham style, one cell
+    per step along the major axis), consecutive cells are 8-connected so a clear
+    segment is also a walkable route with the moves of _bfs
+    ends: (k, 2) array of cells
+    Returns a bool array, True where the whole segment is passable
+    '''
+    start = np.asarray(start)
+    delta = np.asarray(ends) - start
+    steps = np.abs(delta).max(axis=1)
+    t = np.arange(steps.max() + 1)
+    fraction = np.minimum(t, steps[:, None])/np.maximum(steps, 1)[:, None]
+    xs = start[0] + np.rint(fraction*delta[:, :1]).astype(int)
+    ys = start[1] + np.rint(fraction*delta[:, 1:]).astype(int)
+    return passable[xs, ys].all(axis=1)
+
+def _farthest_visible(passable, points, i, end, window):
+    '''
+    Index of the farthest of points[i + 1:end + 1] in line of sight of points[i],
+    checked window points at a time from the far end
+    '''
+    while True:
+        first = max(end - window + 1, i + 1)
+        visible = np.flatnonzero(line_of_sight(passable, points[i], points[first:end + 1]))
+        if visible.size:
+            return first + int(visible.max())
+        # consecutive cells of a path always see each other, so this stops at i + 1
+        end = first - 1
+
+def smooth_path(path, passable, window=64):
+    '''
+    Reduces a path to its turning points by string pulling: from each kept point
+    jump to the farthest later point still in line of sight
+    passable: 2D bool mask the shortcuts must stay inside
+    window: number of points checked together, the reach doubles while its
+    last point is still visible, so straight runs collapse to their ends
+    '''
+    if len(path) <= 2:
+        return list(path)
+    points = np.array(path)
+    last = len(path) - 1
+    smoothed = [path[0]]
+    i = 0
+    while i < last:
+        reach = window
+        while i + reach < last and line_of_sight(passable, points[i], points[i + reach:i + reach + 1])[0]:
+            reach *= 2
+        i = _farthest_visible(passable, points, i, min(i + reach, last), window)
+        smoothed.append(path[i])
+    return smoothed
+
+def _bfs(grid=None, goal_nodes=None, entry=(3, 25), fire=None, deadline=None, steps_per_move=1):
+    '''
+    Breadth first search over flat cell indices, expanded one level at a time.
+    Children are discovered in queue order and move order, so parents and the
+    goal reached are the same as with a cell by cell FIFO search.
+    deadline: optional padded flat array, a cell reached after level moves is
+    only entered if level*steps_per_move < deadline
+    Returns the predecessor array (-1 for no parent) and the flat index of the
+    goal, or None if no goal is reachable
+    '''
+    shape = grid.shape
+    passable = padded_mask(grid, fire)
+    offsets = move_offsets(shape[1])
+    goal_mask = np.zeros(passable.size, dtype=bool)
+    goal_mask[[to_index(node, shape) for node in goal_nodes if is_valid(grid, node)]] = True
+    parent = np.full(passable.size, -1, dtype=np.int32)
+    visited = np.zeros(passable.size, dtype=bool)
+    start = to_index(entry, shape)
+    visited[start] = True
+    frontier = np.array([start], dtype=np.int32)
+    level = 0
+    while frontier.size:
+        reached = frontier[goal_mask[frontier]]
+        if reached.size:
+            return (parent, int(reached[0]))
+        level += 1
+        children = (frontier[:, None] + offsets).ravel()
+        keep = passable[children] & ~visited[children]
+        if deadline is not None:
+            keep &= deadline[children] > level*steps_per_move
+        children, first = np.unique(children[keep], return_index=True)
+        order = np.argsort(first)
+        children = children[order]
+        parent[children] = np.repeat(frontier, offsets.size)[keep][first[order]]
+        visited[children] = True
+        frontier = children
+    return (parent, None)
+
+def octile_distance(dx, dy):
+    '''
+    Exact length of the shortest 8-connected move sequence over open space
+    dx, dy: absolute row and column differences, scalars or numpy arrays
+    '''
+    return np.maximum(dx, dy) + (math.sqrt(2) - 1)*np.minimum(dx, dy)
+
+def _goal_heuristic(goals, shape):
+    '''
+    Returns a function giving the octile distance from a flat index to the closest goal
+    '''
+    goal_x = np.array([node[0] for node in goals]) + 1
+    goal_y = np.array([node[1] for node in goals]) + 1
+    width = shape[1] + 2
+
+    def heuristic(index):
+        x, y = divmod(index, width)
+        return float(octile_distance(np.abs(goal_x - x), np.abs(goal_y - y)).min())
+    return heuristic
+
+def _astar(grid=None, goal_nodes=None, entry=(3, 25), fire=None, cell_cost=None):
+    '''
+    A* over flat cell indices with 1 / sqrt(2) move costs.
+    The heuristic is the octile distance to the closest goal, which never
+    overestimates, so the first goal popped is reached by a shortest route.
+    cell_cost: optional padded flat list of costs >= 1, a move costs its
+    length times the cost of the cell it enters
+    Returns the predecessor list and the flat index of the goal, or None
+    '''
+    shape = grid.shape
+    passable = padded_mask(grid, fire).tolist()
+    moves = list(zip(move_offsets(shape[1]).tolist(), MOVE_COSTS))
+    goals = [node for node in goal_nodes if is_valid(grid, node) and passable[to_index(node, shape)]]
+    goal_set = set(to_index(node, shape) for node in goals)
+    if not goal_set:
+        return (None, None)
+    heuristic = _goal_heuristic(goals, shape)
+
+    start = to_index(entry, shape)
+    parent = [-1]*len(passable)
+    cost = {start: 0.0}
+    closed = bytearray(len(passable))
+    h = heuristic(start)
+    heap = [(h, h, start)]
+    while heap:
+        _, _, current = heapq.heappop(heap)
+        if closed[current]:
+            continue
+        if current in goal_set:
+            return (parent, current)
+        closed[current] = 1
+        current_cost = cost[current]
+        for offset, step in moves:
+            child = current + offset
+            if not passable[child] or closed[child]:
+                continue
+            new_cost = current_cost + (step if cell_cost is None else step*cell_cost[child])
+            if new_cost < cost.get(child, math.inf):
+                cost[child] = new_cost
+                parent[child] = current
+                h = heuristic(child)
+                heapq.heappush(heap, (new_cost + h, h, child))
+    return (parent, None)
+
+def _jps(grid=None, goal_nodes=None, entry=(3, 25), fire=None):
+    '''
+    Jump Point Search, A* that only expands the cells where a shortest route may turn.
+    Straight and diagonal runs are scanned without queueing their cells, a run stops
+    at a goal or at a cell with a forced neighbour, i.e. an open cell that can only be
+    reached optimally through it because a wall sits beside the run. Diagonal moves
+    past wall corners are allowed, as in _bfs, and routes are as short as _astar's.
+    Returns the predecessor list and the flat index of the goal, or None
+    '''
+    shape = grid.shape
+    width = shape[1] + 2
+    passable = padded_mask(grid, fire).tolist()
+    goals = [node for node in goal_nodes if is_valid(grid, node) and passable[to_index(node, shape)]]
+    goal_set = set(to_index(node, shape) for node in goals)
+    if not goal_set:
+        return (None, None)
+    heuristic = _goal_heuristic(goals, shape)
+
+    def jump(index, dx, dy):
+        step = dx*width + dy
+        while True:
+            index += step
+            if not passable[index]:
+                return -1
+            if index in goal_set:
+                return index
+            if dx and dy:
+                if (not passable[index - dx*width] and passable[index - dx*width + dy]) or \
+                        (not passable[index - dy] and passable[index + dx*width - dy]):
+                    return index
+                if jump(index, dx, 0) >= 0 or jump(index, 0, dy) >= 0:
+                    return index
+            elif dx:
+                if (not passable[index + 1] and passable[index + dx*width + 1]) or \
+                        (not passable[index - 1] and passable[index + dx*width - 1]):
+                    return index
+            elif (not passable[index + width] and passable[index + width + dy]) or \
+                    (not passable[index - width] and passable[index - width + dy]):
+                return index
+
+    def directions(index, previous):
+        if previous < 0:
+            return MOVES
+        px, py = divmod(previous, width)
+        x, y = divmod(index, width)
+        dx, dy = (x > px) - (x < px), (y > py) - (y < py)
+        if dx and dy:
+            pruned = [(dx, 0), (0, dy), (dx, dy)]
+            if not passable[index - dx*width]:
+                pruned.append((-dx, dy))
+            if not passable[index - dy]:
+                pruned.append((dx, -dy))
+        elif dx:
+            pruned = [(dx, 0)]
+            if not passable[index + 1]:
+                pruned.append((dx, 1))
+            if not passable[index - 1]:
+                pruned.append((dx, -1))
+        else:
+            pruned = [(0, dy)]
+            if not passable[index + width]:
+                pruned.append((1, dy))
+            if not passable[index - width]:
+                pruned.append((-1, dy))
+        return pruned
+
+    start = to_index(entry, shape)
+    jumped_from = {start: -1}
+    cost = {start: 0.0}
+    closed = set()
+    h = heuristic(start)
+    heap = [(h, h, start)]
     goal = None
-    while q:
-        current = q.popleft()
-        if current in goal_nodes:
+    while heap:
+        _, _, current = heapq.heappop(heap)
+        if current in closed:
+            continue
+        if current in goal_set:
             goal = current
             break
-        children = [
-                    (current[0], current[1]-1), (current[0], current[1]+1), 
-                    (current[0]-1, current[1]), (current[0]+1, current[1]), 
-                    (current[0]-1, current[1]-1), (current[0]+1, current[1]+1), 
-                    (current[0]-1, current[1]+1), (current[0]+1, current[1]-1)
-                    ]
-        for child in children:
-            if is_safe(grid, child, fire):
-                if child not in visited:
-                    q.append(child)
-                    visited.add(child)
-                    parent[child] = current
+        closed.add(current)
+        x, y = divmod(current, width)
+        for dx, dy in directions(current, jumped_from[current]):
+            point = jump(current, dx, dy)
+            if point < 0 or point in closed:
+                continue
+            px, py = divmod(point, width)
+            new_cost = cost[current] + float(octile_distance(abs(px - x), abs(py - y)))
+            if new_cost < cost.get(point, math.inf):
+                cost[point] = new_cost
+                jumped_from[point] = current
+                h = heuristic(point)
+                heapq.heappush(heap, (new_cost + h, h, point))
     if goal is None:
-        return (parent, None)
+        return (None, None)
+    # fill in the cells between consecutive jump points
+    parent = [-1]*len(passable)
+    point = goal
+    while jumped_from[point] >= 0:
+        previous = jumped_from[point]
+        px, py = divmod(previous, width)
+        x, y = divmod(point, width)
+        step = ((x > px) - (x < px))*width + (y > py) - (y < py)
+        while point != previous:
+            parent[point] = point - step
+            point -= step
     return (parent, goal)
 
-def path_finder(grid, goal_nodes, entry, fire = None):
+def _spacetime(grid=None, goal_nodes=None, entry=(3, 25), fire=None, ignition=None, steps_per_move=1):
+    '''
+    Search over (cell, step) states against predicted fire spread.
+    ignition: per-cell step at which the cell starts burning, negative if never
+    steps_per_move: simulation steps the occupant needs to cross one cell
+    Cells only ever become unsafe, so waiting never helps and the earliest
+    arrival at a cell dominates every later one: the time-expanded search
+    reduces to a BFS whose level t only admits cells still unburnt at step t.
+    '''
+    ignition = np.asarray(ignition, dtype=float)
+    if ignition.shape != grid.shape:
+        raise ValueError('ignition must have the same shape as the grid')
+    deadline = np.pad(np.where(ignition < 0, np.inf, ignition), 1).ravel()
+    if not deadline[to_index(entry, grid.shape)] > 0:
+        raise ValueError('Entry point is not safe')
+    return _bfs(grid, goal_nodes, entry, fire, deadline=deadline, steps_per_move=steps_per_move)
+
+def _risk(grid=None, goal_nodes=None, entry=(3, 25), fire=None):
+    '''
+    Weighted shortest path where cells near the fire or in the warning state cost more.
+    The cost map comes from fire_risk and is shared by all requests on the same fire,
+    costs are >= 1 so the octile heuristic of _astar stays admissible
+    '''
+    return _astar(grid, goal_nodes, entry, fire, cell_cost=fire_risk.padded_costs(fire))
+
+# routing modes accepted by path_finder
+_ENGINES = {
+    'bfs': _bfs,
+    'astar': _astar,
+    'jps': _jps,
+    'spacetime': _spacetime,
+    'risk': _risk,
+}
+
+def path_finder(grid, goal_nodes, entry, fire = None, mode='bfs', ignition=None, steps_per_move=1, transform=None,
+                labels=None, k=1):
     '''
     This function is used to find the path from the entry point to the nearest goal node
     grid: 2D list of integers, where 0 is a wall, 1 is a path
     goal_nodes:2D list of goal nodes in the grid
     entry: list of entry point coordinates [x, y]
     fire: 2D list of fire in the grid, where 1 is fire and 0 is no fire
+    mode: bfs (fewest moves), astar (shortest distance, diagonals cost sqrt(2)),
+    jps (same routes as astar, faster on open floors)
+    spacetime (fewest moves through cells reached before they ignite)
+    or risk (shortest distance weighted by proximity to the fire)
+    ignition: 2D list of predicted ignition steps, -1 for never, required by spacetime
+    steps_per_move: simulation steps needed to move one cell, used by spacetime
+    transform: georeference [a, b, c, d, e, f] of the grid (see georeference)
+    labels: optional connected component labels of the grid under this fire
+    (components.label), goals outside the entry's component are dropped before searching
+    k: number of routes, above 1 a list of up to k diverse routes is returned (bfs mode only),
+    the shortest first
     '''
+    if mode not in _ENGINES:
+        raise ValueError(f'Invalid mode {mode}, mode can be one of {", ".join(_ENGINES)}')
     grid = np.array(grid)
     entry = tuple(entry)
     goal_nodes = [tuple(node) for node in goal_nodes]
@@ -76,31 +380,70 @@ def path_finder(grid, goal_nodes, entry, fire = None):
         fire = np.zeros(grid.shape, dtype=int)
     if not is_safe(grid, entry, fire):
         raise ValueError('Entry point is not safe')
+    if labels is not None:
+        component = labels[entry]
+        goal_nodes = [node for node in goal_nodes if is_valid(grid, node) and labels[node] == component]
+        if not goal_nodes:
+            return []
+    if k > 1:
+        if mode != 'bfs':
+            raise ValueError('Alternative routes are only available in bfs mode')
+        backward = distance_field.build_field(grid, goal_nodes, fire)
+        passable = unpad(backward.passable, backward.shape)
+        return [format_path(route, passable, transform) for route in alternatives.routes(backward, entry, k)]
     
-    parent, goal = _bfs(grid, goal_nodes, entry, fire)
+    options = {}
+    if mode == 'spacetime':
+        if ignition is None:
+            raise ValueError('ignition is required in spacetime mode')
+        options = {'ignition': ignition, 'steps_per_move': float(steps_per_move)}
+    parent, goal = _ENGINES[mode](grid, goal_nodes, entry, fire, **options)
     if goal is None:
         return []
     
-    path = _get_path(parent, goal)
-    path = _path_shortner(path)
-    return [calculate_lat_lon(coordinates, grid.shape) for coordinates in path]
+    path = _get_path(parent, goal, grid.shape)
+    passable = (grid != 0) & (fire != 1)
+    if mode == 'spacetime':
+        # shortcuts may only cross cells that are not predicted to ignite
+        passable &= np.asarray(ignition) < 0
+    elif mode == 'risk':
+        # shortcuts may only cross cells that carry no fire risk
+        passable &= fire_risk.risk_free(fire)
+    passable[tuple(np.transpose(path))] = True
+    return format_path(path, passable, transform)
+
+def format_path(path, passable, transform=None):
+    '''
+    Smooths a path of grid cells and converts it to [lon, lat] points
+    passable: 2D bool mask of the cells the smoothed path may cross
+    transform: georeference of the grid, defaults to the module bounds
+    '''
+    path = smooth_path(path, passable)
+    if not path:
+        return []
+    transform = georeference(passable.shape) if transform is None else transform
+    return cells_to_lon_lat(path, transform).tolist()
+
+def unpad(passable, shape):
+    '''
+    2D view of a padded flat mask (see padded_mask) without its border
+    '''
+    return passable.reshape(shape[0] + 2, shape[1] + 2)[1:-1, 1:-1]
+
+# goal kinds a user can navigate to, in the order map_handler returns them
+METHODS = ('fire', 'med', 'extinguisher')
 
 def map_handler(grid):
+    '''
+    Splits a floor map into the walkable grid (0 is a wall) and the
+    fire exits (2), med kits (3) and extinguishers (4) as [x, y] lists
+    '''
     grid = np.array(grid)
-    fire_exits, med_kits, extinguishers = [], [], []
-    for i in range(grid.shape[0]):
-        for j in range(grid.shape[1]):
-            if grid[i, j] == 2:
-                fire_exits.append([i, j])
-                grid[i, j] = 1
-            elif grid[i, j] == 3:
-                med_kits.append([i, j])
-                grid[i, j] = 1
-            elif grid[i, j] == 4:
-                extinguishers.append([i, j])
-                grid[i, j] = 1
-            elif grid[i, j] == -1:
-                grid[i, j] = 0
+    fire_exits = np.argwhere(grid == 2).tolist()
+    med_kits = np.argwhere(grid == 3).tolist()
+    extinguishers = np.argwhere(grid == 4).tolist()
+    grid[(grid == 2) | (grid == 3) | (grid == 4)] = 1
+    grid[grid == -1] = 0
     return grid, fire_exits, med_kits, extinguishers
 
 
@@ -120,6 +463,34 @@ def calculate_lat_lon(coordinates, size):
     
     return [lon, lat]
 
+def georeference(size, corner=None, opposite=None):
+    '''
+    Affine transform [a, b, c, d, e, f] of a grid, taking cell (i, j) to
+    lon = a*i + b*j + c and lat = d*i + e*j + f, built the way calculate_lat_lon
+    maps the grid between the top left and bottom right [lat, lon] corners
+    '''
+    corner = top_left if corner is None else corner
+    opposite = bottom_right if opposite is None else opposite
+    rows, cols = size
+    delta_long = (opposite[1] - corner[1])/cols
+    delta_lat = (corner[0] - opposite[0])/rows
+    return np.array([0, delta_long, corner[1], -delta_lat, 0, corner[0]])
+
+def cells_to_lon_lat(cells, transform):
+    '''
+    Converts an (..., 2) array of (i, j) cells to [lon, lat] points in one call
+    '''
+    matrix = np.asarray(transform, dtype=float).reshape(2, 3)
+    return np.asarray(cells, dtype=float) @ matrix[:, :2].T + matrix[:, 2]
+
+def lon_lat_to_cells(points, transform):
+    '''
+    Inverse of cells_to_lon_lat, converts [lon, lat] points to the nearest (i, j) cells
+    '''
+    matrix = np.asarray(transform, dtype=float).reshape(2, 3)
+    cells = (np.asarray(points, dtype=float) - matrix[:, 2]) @ np.linalg.inv(matrix[:, :2]).T
+    return np.rint(cells).astype(int)
+
 # def calculate_lat_lon(coordinates, size):
 #     i, j = coordinates
 #     rows, cols = size
@@ -0,0 +1,117 @@
+'''
+Alternative routes by the via node method.
+Two BFS trees are built once: the distance field from the goals (the same one
+the bfs mode walks) and a field from the entry. Every cell v then stands for a
+route, the shortest way from the entry to v followed by the shortest way from v
+to a goal, whose length is known without a search. Routes are taken in order of
+length, up to a stretch over the shortest, skipping those that double back or
+whose smoothed lines, as format_path draws them, share too many cells with a
+route already chosen, so k routes cost two BFS plus k walks instead of k searches.
+'''
+
+import numpy as np
+
+from . import PathFinder
+from . import bitbfs
+from . import distance_field
+
+stretch = 0.5       # alternatives are at most this much longer than the shortest route
+max_overlap = 0.5   # largest share of an alternative's cells that may lie along a chosen route
+spread = 2          # cells this close to a chosen route count as lying along it
+separation = 0.1    # share of the shortest length a via node keeps away from chosen routes
+attempts = 64       # via nodes walked before giving up on finding more routes
+
+def _walk(field, index):
+    path = [index]
+    while field.dist[index] > 0:
+        index = int(field.next_hop[index])
+        path.append(index)
+    return path
+
+def _near(route, passable, shape, distance):
+    '''
+    Padded flat mask of the cells at most distance walkable moves away from a route
+    '''
+    cells = np.zeros(passable.size, dtype=bool)
+    cells[route] = True
+    rows, cols = shape
+    reached = bitbfs.distance_layers(passable, cells.reshape(rows + 2, cols + 2), distance)
+    return (reached >= 0).ravel()
+
+def _drawn(route, passable):
+    '''
+    Padded flat indices of the cells crossed by the smoothed route, the route as it is
+    shown once format_path has string pulled it
+    passable: padded 2D mask the route is smoothed in
+    '''
+    width = passable.shape[1]
+    points = np.stack(np.divmod(np.asarray(route), width), axis=1)
+    corners = np.array(PathFinder.smooth_path([tuple(point) for point in points.tolist()], passable))
+    cells = [corners[:1]]
+    for start, end in zip(corners[:-1], corners[1:]):
+        # rasterized as line_of_sight checks the segment
+        delta = end - start
+        steps = int(np.abs(delta).max())
+        fraction = np.arange(1, steps + 1)[:, None]/steps
+        cells.append(start + np.rint(fraction*delta).astype(int))
+    cells = np.concatenate(cells)
+    return np.unique(cells[:, 0]*width + cells[:, 1])
+
+def via_routes(backward, forward, k=3):
+    '''
+    Returns up to k routes from the entry as lists of flat padded indices, shortest first
+    backward: DistanceField from the goal nodes
+    forward: DistanceField from the entry alone
+    '''
+    start = int(np.flatnonzero(forward.dist == 0)[0])
+    if backward.dist[start] < 0:
+        return []
+    routes = [_walk(backward, start)]
+    best = backward.dist[start]
+    total = np.where((backward.dist >= 0) & (forward.dist >= 0), backward.dist + forward.dist, -1)
+    candidates = np.flatnonzero((total > best) & (total <= (1 + stretch)*best))
+    # a route doubles back at its via node unless the first step towards the goal leads away from the entry
+    hop = backward.next_hop[candidates]
+    candidates = candidates[(hop == candidates) | (forward.dist[hop] == forward.dist[candidates] + 1)]
+    candidates = candidates[np.argsort(total[candidates], kind='stable')]
+    shape = backward.shape
+    passable = backward.passable.reshape(shape[0] + 2, shape[1] + 2)
+    away = max(spread, int(separation*best))
+    # routes are compared as they are drawn, two routes that smooth to the same lines are copies
+    drawn = _drawn(routes[0], passable)
+    along = _near(drawn, passable, shape, spread)
+    # via nodes close to a chosen route, or on a rejected one, only lead to near copies of it
+    blocked = _near(drawn, passable, shape, away)
+    tried = 0
+    for via in candidates.tolist():
+        if len(routes) >= k or tried >= attempts:
+            break
+        if blocked[via]:
+            continue
+        route = _walk(forward, via)[::-1] + _walk(backward, via)[1:]
+        if len(set(route)) < len(route):
+            # doubles back further on, not counted as an attempt
+            blocked[route] = True
+            continue
+        tried += 1
+        drawn = _drawn(route, passable)
+        if along[drawn].sum() > max_overlap*drawn.size:
+            blocked |= _near(drawn, passable, shape, away)
+            continue
+        routes.append(route)
+        along |= _near(drawn, passable, shape, spread)
+        blocked |= _near(drawn, passable, shape, away)
+    return routes
+
+def routes(backward, entry, k=3):
+    '''
+    Returns up to k diverse routes from entry as lists of (x, y) cells
+    backward: DistanceField of the goal nodes
+    '''
+    x, y = entry
+    rows, cols = backward.shape
+    if not (0 <= x < rows and 0 <= y < cols) or not backward.passable[PathFinder.to_index(entry, backward.shape)]:
+        raise ValueError('Entry point is not safe')
+    forward = distance_field.build_field(PathFinder.unpad(backward.passable, backward.shape), [entry])
+    return [[PathFinder.to_coordinates(index, backward.shape) for index in route]
+            for route in via_routes(backward, forward, k)]
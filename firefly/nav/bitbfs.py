@@ -0,0 +1,126 @@
+'''
+Bit parallel breadth first search.
+Every row of a mask is packed into uint64 words, bit b of word k holding column
+64*k + b. One BFS level grows the whole frontier to its 8 neighbours with word
+shifts (carrying the edge bits into the neighbouring word) and row shifts, and
+masks it with the passable cells not yet visited, so a level costs rows*cols/64
+word operations however large the frontier is, and only the band of rows the
+frontier occupies is touched. Several independent searches (one per exit, say)
+can be stacked on a leading axis to advance together in the same operations,
+distance_layers runs them one by one, each in the band of its own frontier.
+The levels are recorded as their nonzero words and unpacked into distances
+once at the end, so a level costs no scattered writes.
+Moves are the 8 moves of PathFinder, diagonal moves may pass between two walls
+as they do there.
+'''
+
+import numpy as np
+
+def pack(mask):
+    '''
+    Packs a (..., rows, cols) bool mask into a (..., rows, words) uint64 array
+    '''
+    mask = np.asarray(mask, dtype=bool)
+    words = -(-mask.shape[-1]//64)
+    packed = np.packbits(mask, axis=-1, bitorder='little')
+    padding = [(0, 0)]*(mask.ndim - 1) + [(0, words*8 - packed.shape[-1])]
+    packed = np.ascontiguousarray(np.pad(packed, padding))
+    return packed.view('<u8').reshape(mask.shape[:-1] + (words,))
+
+def unpack(words, cols):
+    '''
+    Unpacks a (..., rows, words) uint64 array back into a (..., rows, cols) bool mask
+    '''
+    packed = np.ascontiguousarray(words, dtype='<u8').view(np.uint8)
+    return np.unpackbits(packed, axis=-1, count=cols, bitorder='little').astype(bool)
+
+def dilate(words):
+    '''
+    Grows a packed mask by one cell in all 8 directions
+    '''
+    one, top = np.uint64(1), np.uint64(63)
+    grown = words << one
+    grown[..., 1:] |= words[..., :-1] >> top
+    left = words >> one
+    left[..., :-1] |= words[..., 1:] << top
+    grown |= left
+    grown |= words
+    spread = grown.copy()
+    spread[..., 1:, :] |= grown[..., :-1, :]
+    spread[..., :-1, :] |= grown[..., 1:, :]
+    return spread
+
+def layers(passable, sources, max_distance=None):
+    '''
+    Yields the BFS levels of a multi source search, level 0 being the passable sources,
+    as (first row, packed rows) of the band of rows the level occupies
+    passable: 2D bool mask of the walkable cells
+    sources: (rows, cols) bool mask of the cells the search starts from, or
+    (searches, rows, cols) masks of independent searches run side by side
+    max_distance: last level to yield, None for all
+    '''
+    passable = np.asarray(passable, dtype=bool)
+    # bits past the last column stay clear, so nothing leaks across the row end
+    open_cells = pack(passable)
+    rows, words = open_cells.shape
+    visited = pack(np.asarray(sources, dtype=bool) & passable)
+    band = visited
+    top = 0
+    level = 0
+    while max_distance is None or level <= max_distance:
+        occupied = np.flatnonzero(band.reshape(-1, *band.shape[-2:]).any(axis=(0, 2)))
+        if not occupied.size:
+            return
+        first, last = top + occupied[0], top + occupied[-1] + 1
+        band = band[..., occupied[0]:occupied[-1] + 1, :]
+        yield first, band
+        level += 1
+        # only the rows next to the level can be reached by the next one
+        top, bottom = max(first - 1, 0), min(last + 1, rows)
+        grown = np.zeros(band.shape[:-2] + (bottom - top, words), dtype=band.dtype)
+        grown[..., first - top:last - top, :] = band
+        band = dilate(grown)
+        band &= open_cells[top:bottom]
+        band &= ~visited[..., top:bottom, :]
+        visited[..., top:bottom, :] |= band
+
+def distance_layers(passable, sources, max_distance=None):
+    '''
+    Number of moves from every cell to the nearest source, -1 where no source is reachable
+    passable: 2D bool mask of the walkable cells
+    sources: (rows, cols) bool mask of the cells the search starts from, or
+    (searches, rows, cols) masks, giving (searches, rows, cols) distances
+    max_distance: cells farther than this are left at -1
+    '''
+    passable = np.asarray(passable, dtype=bool)
+    sources = np.asarray(sources, dtype=bool)
+    if sources.ndim > 2:
+        # stacked searches share one band spanning the rows of all of them, which
+        # costs more than it saves once they drift apart, so each runs in its own band
+        dist = np.empty(sources.shape[:-2] + passable.shape, dtype=np.int32)
+        flat = dist.reshape(-1, *passable.shape)
+        for search, search_sources in enumerate(sources.reshape(-1, *passable.shape)):
+            flat[search] = distance_layers(passable, search_sources, max_distance)
+        return dist
+    words = -(-passable.shape[1]//64)
+    # each level only keeps its nonzero words, all levels are unpacked together at the end
+    positions, values, levels = [], [], []
+    for level, (first, band) in enumerate(layers(passable, sources, max_distance)):
+        # comparing first takes numpy's fast path for bool masks
+        index = np.flatnonzero(band != 0)
+        positions.append(first*words + index)
+        values.append(band.ravel()[index])
+        levels.append(np.full(index.size, level, dtype=np.int32))
+    dist = np.full(passable.shape, -1, dtype=np.int32)
+    if not positions:
+        return dist
+    positions, levels = np.concatenate(positions), np.concatenate(levels)
+    # a frontier word mostly has a few set bits, so only its nonzero bytes are unpacked
+    packed = np.concatenate(values).view(np.uint8)
+    nonzero = np.flatnonzero(packed != 0)
+    hit, bit = np.divmod(np.flatnonzero(np.unpackbits(packed[nonzero], bitorder='little')), 8)
+    event, byte = np.divmod(nonzero[hit], 8)
+    # word position in the packed (rows, words) layout to the cell its bit stands for
+    row, word = np.divmod(positions[event], words)
+    dist[row, word*64 + byte*8 + bit] = levels[event]
+    return dist
@@ -0,0 +1,95 @@
+'''
+Offline route bundles.
+A bundle holds, for one building and fire snapshot, the direction to step in
+from every cell of the floor towards the nearest fire exit, med kit and
+extinguisher, so a client can route locally until the fire matrix changes.
+
+Layout (little endian):
+    4s   magic b'FFRB'
+    B    format version (1)
+    3B   padding
+    2I   rows, cols
+    6d   georeference [a, b, c, d, e, f], lon = a*x + b*y + c, lat = d*x + e*y + f
+    32s  snapshot version, ascii, the ETag of the bundle
+    I    length of the compressed planes
+    ...  zlib compressed uint8 planes (fire, med, extinguisher), each rows*cols, row major
+
+A direction code 0-7 means step by PathFinder.MOVES[code], 8 marks a goal and
+255 a cell with no route (walls, fire, or cut off from every goal).
+'''
+
+import struct
+import zlib
+
+import numpy as np
+
+from . import PathFinder
+from . import cache
+from . import distance_field
+from . import maps
+
+MAGIC = b'FFRB'
+FORMAT = 1
+GOAL = 8
+NO_ROUTE = 255
+HEADER = struct.Struct('<4sB3x2I6d32sI')
+
+def direction_codes(field):
+    '''
+    uint8 (rows, cols) direction codes of a distance field
+    '''
+    rows, cols = field.shape
+    offsets = PathFinder.move_offsets(cols)
+    order = np.argsort(offsets)
+    index = np.arange(field.passable.size)
+    step = field.next_hop - index
+    codes = order[np.clip(np.searchsorted(offsets, step, sorter=order), 0, len(offsets) - 1)].astype(np.uint8)
+    codes[step == 0] = GOAL
+    codes[field.dist < 0] = NO_ROUTE
+    return codes.reshape(rows + 2, cols + 2)[1:-1, 1:-1]
+
+def version(building, fire):
+    '''
+    Identifies the building map and fire snapshot a bundle was built from
+    '''
+    # microseconds, edits saved within the same second still get different versions
+    return f'{round(building.updated_at.timestamp()*10**6):016d}-{cache.array_digest(fire)[:15]}'
+
+def pack(fields, transform, snapshot):
+    '''
+    Serializes the distance fields of every method into a bundle
+    fields: dict of method to DistanceField, see distance_field.building_fields
+    transform: georeference of the floor
+    snapshot: version string of the bundle
+    '''
+    rows, cols = fields[PathFinder.METHODS[0]].shape
+    planes = np.stack([direction_codes(fields[method]) for method in PathFinder.METHODS])
+    body = zlib.compress(planes.tobytes(), 6)
+    header = HEADER.pack(MAGIC, FORMAT, rows, cols, *np.asarray(transform, dtype=float).tolist(),
+                         snapshot.encode('ascii'), len(body))
+    return header + body
+
+def unpack(data):
+    '''
+    Reads a bundle back, returns the header fields and the (3, rows, cols) direction planes
+    '''
+    magic, fmt, rows, cols, *rest = HEADER.unpack_from(data)
+    if magic != MAGIC or fmt != FORMAT:
+        raise ValueError('Not a route bundle of this format')
+    transform, snapshot, length = rest[:6], rest[6], rest[7]
+    planes = np.frombuffer(zlib.decompress(data[HEADER.size:HEADER.size + length]), dtype=np.uint8)
+    header = {'shape': (rows, cols), 'georeference': list(transform), 'version': snapshot.decode('ascii')}
+    return header, planes.reshape(len(PathFinder.METHODS), rows, cols)
+
+_bundles = cache.BoundedCache(max_entries=64)
+
+def building_bundle(building, fire, floor=0):
+    '''
+    Returns (version, bundle bytes) of a building
+    '''
+    snapshot = version(building, fire)
+    def build():
+        fields = distance_field.building_fields(building, PathFinder.METHODS, fire, floor)
+        transform = maps.georeference(building, fields[PathFinder.METHODS[0]].shape)
+        return pack(fields, transform, snapshot)
+    return snapshot, _bundles.get_or_build((building.id, floor), snapshot, build)
@@ -0,0 +1,184 @@
+'''
+In-process caches shared by the nav views.
+Everything cached here is derived from a Building row, so entries are keyed
+(or validated) against Building.updated_at and a digest of the fire matrix.
+'''
+
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+def array_digest(array):
+    '''
+    Short stable digest of an integer matrix such as a fire matrix or a floor map,
+    used to detect a new fire snapshot or an edited map
+    array: nested list or numpy array of any shape
+    '''
+    array = np.ascontiguousarray(array, dtype=np.int8)
+    digest = hashlib.blake2b(array.tobytes(), digest_size=16)
+    digest.update(str(array.shape).encode())
+    return digest.hexdigest()
+
+def building_token(building, fire):
+    '''
+    Identifies the state of a building that derived data depends on
+    '''
+    return (building.updated_at, array_digest(fire))
+
+class BoundedCache:
+    '''
+    Thread safe LRU dictionary holding at most max_entries items and, when
+    max_bytes is set, at most max_bytes of the sizes given to set
+    '''
+    def __init__(self, max_entries=128, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value, size=0):
+        '''
+        size: estimated bytes of value, counted against max_bytes
+        '''
+        with self._lock:
+            self.bytes += size - self._sizes.get(key, 0)
+            self._data[key] = value
+            self._sizes[key] = size
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries or \
+                    (self.max_bytes is not None and self.bytes > self.max_bytes and len(self._data) > 1):
+                old, _ = self._data.popitem(last=False)
+                self.bytes -= self._sizes.pop(old)
+
+    def get_or_build(self, key, token, build):
+        '''
+        Returns the value cached under key if it was built for token, otherwise
+        calls build() and caches its result against token
+        token: state the value is derived from, such as building_token
+        '''
+        cached = self.get(key)
+        if cached is not None and cached[0] == token:
+            return cached[1]
+        value = build()
+        self.set(key, (token, value))
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            self.bytes -= self._sizes.pop(key, 0)
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+def size_of(value):
+    '''
+    Rough size in bytes of a response made of dicts, lists and scalars,
+    bytes such as a rendered response are sized without looking inside
+    '''
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(size_of(key) + size_of(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(size_of(item) for item in value)
+    return size
+
+class SnapshotCache:
+    '''
+    Thread safe LRU cache of values derived from one snapshot of a building,
+    bounded by the total size of its values in bytes.
+    Entries are grouped by building: once a new snapshot token of a building is
+    seen, every entry of its previous snapshot is dropped.
+    Values larger than max_entry_bytes (max_bytes by default) are not cached.
+    '''
+    def __init__(self, max_bytes=32*2**20, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes if max_entry_bytes is None else max_entry_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._tokens = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        _, size = self._data.pop(key)
+        self.bytes -= size
+        keys = self._keys.get(key[0])
+        keys.discard(key)
+        if not keys:
+            del self._keys[key[0]]
+
+    def snapshot(self, building, token):
+        '''
+        Records the current snapshot token of a building, invalidating its entries when it changed
+        '''
+        with self._lock:
+            if self._tokens.get(building) == token:
+                return
+            self._tokens[building] = token
+            for key in list(self._keys.get(building, ())):
+                self._drop(key)
+
+    def get(self, building, key, default=None):
+        with self._lock:
+            key = (building, self._tokens.get(building), key)
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def set(self, building, key, value, token=None):
+        '''
+        token: snapshot the value was derived from, the value is not stored when
+        the building has moved on to another snapshot since
+        '''
+        size = size_of(value)
+        with self._lock:
+            if size > self.max_entry_bytes or token != self._tokens.get(building):
+                return
+            key = (building, token, key)
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, size)
+            self._keys.setdefault(building, set()).add(key)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self._data)))
+
+    def invalidate(self, building):
+        with self._lock:
+            self._tokens.pop(building, None)
+            for key in list(self._keys.get(building, ())):
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._data), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits/lookups if lookups else 0.0}
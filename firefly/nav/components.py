@@ -0,0 +1,82 @@
+'''
+Connected components of the walkable cells.
+Cells are connected the way PathFinder moves, to all 8 neighbours. Labels are
+computed for a whole floor at once by hooking the roots of neighbouring cells
+onto the smaller root and compressing the pointers, in numpy rounds over every
+pair of neighbouring cells, and are cached per building and fire snapshot.
+With the labels an entry that is cut off from every goal is answered without a
+search, and searches are only started towards goals that can be reached.
+'''
+
+import numpy as np
+
+from . import cache
+from . import maps
+
+def _pairs(passable):
+    '''
+    Flat indices (u, v) of every pair of neighbouring walkable cells
+    '''
+    rows, cols = passable.shape
+    index = np.arange(rows*cols).reshape(rows, cols)
+    pairs = [
+        (index[:, :-1], index[:, 1:], passable[:, :-1] & passable[:, 1:]),
+        (index[:-1, :], index[1:, :], passable[:-1, :] & passable[1:, :]),
+        (index[:-1, :-1], index[1:, 1:], passable[:-1, :-1] & passable[1:, 1:]),
+        (index[:-1, 1:], index[1:, :-1], passable[:-1, 1:] & passable[1:, :-1]),
+    ]
+    u = np.concatenate([a[keep] for a, _, keep in pairs])
+    v = np.concatenate([b[keep] for _, b, keep in pairs])
+    return u, v
+
+def label(passable):
+    '''
+    Labels the 8 connected components of a 2D bool mask
+    Returns the (rows, cols) int32 labels, 0 for cells that are not passable and
+    1..count numbered in row major order of their first cell, and the count
+    '''
+    passable = np.asarray(passable, dtype=bool)
+    u, v = _pairs(passable)
+    parent = np.arange(passable.size)
+    while True:
+        pu, pv = parent[u], parent[v]
+        low, high = np.minimum(pu, pv), np.maximum(pu, pv)
+        hook = low != high
+        if not hook.any():
+            break
+        # roots only ever point to smaller roots, so no cycles are formed
+        np.minimum.at(parent, high[hook], low[hook])
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+        u, v = u[hook], v[hook]
+    roots, labels = np.unique(parent[passable.ravel()], return_inverse=True)
+    labelled = np.zeros(passable.size, dtype=np.int32)
+    labelled[passable.ravel()] = labels + 1
+    return labelled.reshape(passable.shape), roots.size
+
+def reachable_goals(labels, goal_nodes, entry):
+    '''
+    Goal nodes in the same component as entry, [] if the entry is not passable
+    '''
+    component = labels[tuple(entry)]
+    if component == 0:
+        return []
+    return [node for node in goal_nodes if labels[tuple(node)] == component]
+
+_labels = cache.BoundedCache(max_entries=64)
+
+def building_labels(building, fire, floor=0):
+    '''
+    Returns the component labels and sizes (indexed by label) of a floor of a building
+    '''
+    def build():
+        grid = maps.building_map(building, floor)[0]
+        labels, count = label((grid != 0) & (np.asarray(fire) != 1))
+        labels.setflags(write=False)
+        sizes = np.bincount(labels.ravel(), minlength=count + 1)
+        sizes[0] = 0
+        return labels, sizes
+    return _labels.get_or_build((building.id, floor), cache.building_token(building, fire), build)
@@ -0,0 +1,86 @@
+'''
+Precomputed exit distance fields.
+A field is built by a single reverse multi-source BFS from every goal node
+(fire exits, med kits or extinguishers) and stores, for every cell, the number
+of moves to the nearest goal and the neighbour to step to next. Navigating from
+any entry is then a walk along next_hop, proportional to the path length.
+Fields are cached per building and method against the current fire matrix.
+'''
+
+from typing import NamedTuple, Tuple
+import numpy as np
+
+from . import PathFinder
+from . import cache
+from . import maps
+
+class DistanceField(NamedTuple):
+    shape: Tuple[int, int]
+    passable: np.ndarray  # padded, flattened bool mask
+    dist: np.ndarray      # moves to the nearest goal, -1 if unreachable
+    next_hop: np.ndarray  # flat index of the next cell towards that goal
+
+def build_field(grid, goal_nodes, fire=None):
+    '''
+    grid: 2D array where 0 is a wall and anything else is walkable
+    goal_nodes: list of [x, y] goal cells
+    fire: 2D array, 1 marks a burning cell
+    '''
+    grid = np.asarray(grid)
+    shape = grid.shape
+    passable = PathFinder.padded_mask(grid, fire)
+    offsets = PathFinder.move_offsets(shape[1])
+    dist = np.full(passable.size, -1, dtype=np.int32)
+    next_hop = np.full(passable.size, -1, dtype=np.int32)
+
+    goals = [PathFinder.to_index(node, shape) for node in goal_nodes if PathFinder.is_valid(grid, node)]
+    frontier = np.unique(np.array(goals, dtype=np.int32))
+    frontier = frontier[passable[frontier]]
+    dist[frontier] = 0
+    next_hop[frontier] = frontier
+    level = 0
+    while frontier.size:
+        level += 1
+        children = (frontier[:, None] + offsets).ravel()
+        parents = np.repeat(frontier, offsets.size)
+        keep = passable[children] & (dist[children] < 0)
+        children, first = np.unique(children[keep], return_index=True)
+        dist[children] = level
+        next_hop[children] = parents[keep][first]
+        frontier = children
+    return DistanceField(shape, passable, dist, next_hop)
+
+def walk(field, entry):
+    '''
+    Follows next_hop from entry to the nearest goal
+    Returns the list of (x, y) cells, or [] if no goal is reachable
+    '''
+    x, y = entry
+    rows, cols = field.shape
+    if not (0 <= x < rows and 0 <= y < cols):
+        raise ValueError('Entry point is not safe')
+    current = PathFinder.to_index(entry, field.shape)
+    if not field.passable[current]:
+        raise ValueError('Entry point is not safe')
+    if field.dist[current] < 0:
+        return []
+    path = [current]
+    while field.dist[current] > 0:
+        current = int(field.next_hop[current])
+        path.append(current)
+    return [PathFinder.to_coordinates(index, field.shape) for index in path]
+
+_fields = cache.BoundedCache(max_entries=256)
+
+def building_field(building, method, fire, floor=0):
+    '''
+    Returns the distance field of a building for method (fire, med or extinguisher)
+    '''
+    return _fields.get_or_build((building.id, floor, method), cache.building_token(building, fire),
+                                lambda: build_field(*maps.method_goals(building, method, floor), fire))
+
+def building_fields(building, methods, fire, floor=0):
+    '''
+    Returns a dict of distance fields of a building, one per method in methods
+    '''
+    return {method: building_field(building, method, fire, floor) for method in set(methods)}
@@ -0,0 +1,227 @@
+'''
+Capacity aware evacuation of many occupants.
+Every exit gets its own distance field (distance_field.build_field from that
+exit alone), so the distance from every occupant to every exit is a lookup.
+Exits are then assigned as a transportation problem, each exit taking at most
+its capacity of occupants at minimum total distance: exits carry a price (the
+dual of the min cost flow), occupants pick the exit with the lowest distance
+plus price, and the price of an overloaded exit is raised just enough to move
+its surplus to the next best exits, in vectorized rounds over all occupants.
+Paths are walked for all occupants at once along the next_hop of their exit.
+'''
+
+import math
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+from . import PathFinder
+from . import cache
+from . import distance_field
+from . import maps
+
+max_rounds = 200   # pricing rounds before the remaining surplus is moved greedily
+
+class ExitFields(NamedTuple):
+    shape: Tuple[int, int]
+    passable: np.ndarray  # padded, flattened bool mask
+    goals: list           # [x, y] of each exit, in the order of the rows below
+    dist: np.ndarray      # (exits, cells) moves to each exit, -1 if unreachable
+    next_hop: np.ndarray  # (exits, cells) flat index of the next cell towards each exit
+
+def build_fields(grid, goal_nodes, fire=None):
+    '''
+    Distance fields of every goal node on its own
+    grid: 2D array where 0 is a wall and anything else is walkable
+    goal_nodes: list of [x, y] goal cells
+    fire: 2D array, 1 marks a burning cell
+    '''
+    grid = np.asarray(grid)
+    goals = [list(node) for node in goal_nodes if PathFinder.is_valid(grid, node)]
+    fields = [distance_field.build_field(grid, [node], fire) for node in goals]
+    passable = PathFinder.padded_mask(grid, fire)
+    dist = np.array([field.dist for field in fields], dtype=np.int32).reshape(len(goals), passable.size)
+    next_hop = np.array([field.next_hop for field in fields], dtype=np.int32).reshape(len(goals), passable.size)
+    return ExitFields(grid.shape, passable, goals, dist, next_hop)
+
+def _surplus_regret(total, members, exit):
+    '''
+    Extra cost each member of an exit pays to move to its next best exit
+    '''
+    others = total[members].copy()
+    others[:, exit] = math.inf
+    return others.min(axis=1) - total[members, exit]
+
+def _negative_cycle(cost, chosen, load, capacity):
+    '''
+    Finds a set of moves lowering the total cost without breaking capacities,
+    a negative cycle of the residual graph between exits, where a -> b moves the
+    cheapest occupant of a to b and an extra node links exits with room left to
+    exits with occupants
+    Returns a list of (occupant, exit) moves, empty when the assignment is optimal
+    '''
+    exits = cost.shape[1]
+    weight = np.full((exits + 1, exits + 1), math.inf)
+    mover = np.zeros((exits, exits), dtype=np.int64)
+    for exit in np.flatnonzero(load):
+        members = np.flatnonzero(chosen == exit)
+        delta = cost[members] - cost[members, exit][:, None]
+        best = delta.argmin(axis=0)
+        weight[exit, :exits] = delta[best, np.arange(exits)]
+        mover[exit] = members[best]
+    np.fill_diagonal(weight, math.inf)
+    weight[:exits, exits][load < capacity] = 0
+    weight[exits, :exits][load > 0] = 0
+    nodes = exits + 1
+    dist = np.zeros(nodes)
+    pred = np.full(nodes, -1)
+    changed = -1
+    for _ in range(nodes):
+        relaxed = dist[:, None] + weight
+        source = relaxed.argmin(axis=0)
+        better = relaxed[source, np.arange(nodes)] < dist - 1e-9
+        if not better.any():
+            return []
+        dist[better] = relaxed[source, np.arange(nodes)][better]
+        pred[better] = source[better]
+        changed = int(np.flatnonzero(better)[0])
+    for _ in range(nodes):
+        changed = pred[changed]
+    cycle, node = [changed], pred[changed]
+    while node != changed:
+        cycle.append(node)
+        node = pred[node]
+    edges = list(zip(cycle[1:] + cycle[:1], cycle))
+    if sum(weight[a, b] for a, b in edges) >= -1e-9:
+        return []
+    return [(int(mover[a, b]), int(b)) for a, b in edges if a != exits and b != exits]
+
+def assign(cost, capacity):
+    '''
+    Assigns each occupant an exit at minimum total cost with at most capacity occupants per exit
+    cost: (occupants, exits) array, inf where the exit cannot be reached
+    capacity: (exits,) array of the number of occupants each exit can take,
+    scaled up in proportion when the exits cannot take every occupant
+    Returns the exit of each occupant, -1 if it cannot reach any
+    '''
+    cost = np.asarray(cost, dtype=float)
+    occupants, exits = cost.shape
+    choice = np.full(occupants, -1)
+    reachable = np.isfinite(cost).any(axis=1) if exits else np.zeros(occupants, dtype=bool)
+    if not reachable.any():
+        return choice
+    capacity = np.asarray(capacity, dtype=float)
+    if capacity.sum() < reachable.sum():
+        capacity = np.ceil(capacity*reachable.sum()/max(capacity.sum(), 1))
+    cost = cost[reachable]
+    price = np.zeros(exits)
+    for _ in range(max_rounds):
+        total = cost + price
+        chosen = total.argmin(axis=1)
+        load = np.bincount(chosen, minlength=exits)
+        moved = False
+        for exit in np.flatnonzero(load > capacity):
+            regret = _surplus_regret(total, np.flatnonzero(chosen == exit), exit)
+            regret = np.sort(regret[np.isfinite(regret)])
+            surplus = min(int(load[exit] - capacity[exit]), regret.size)
+            if surplus:
+                price[exit] += regret[surplus - 1] + 1e-6
+                moved = True
+        if not moved:
+            break
+    # whatever is still over capacity moves to the cheapest exit with room left
+    total = cost + price
+    load = np.bincount(chosen, minlength=exits)
+    for exit in np.flatnonzero(load > capacity):
+        members = np.flatnonzero(chosen == exit)
+        for member in members[np.argsort(_surplus_regret(total, members, exit))]:
+            if load[exit] <= capacity[exit]:
+                break
+            room = np.isfinite(cost[member]) & (load < capacity)
+            if not room.any():
+                continue
+            target = int(np.argmin(np.where(room, cost[member], math.inf)))
+            chosen[member] = target
+            load[exit] -= 1
+            load[target] += 1
+    # the prices leave the assignment close to optimal, the last gap is closed by cycle canceling
+    for _ in range(occupants):
+        moves = _negative_cycle(cost, chosen, load, np.maximum(capacity, load))
+        if not moves:
+            break
+        for member, target in moves:
+            load[chosen[member]] -= 1
+            load[target] += 1
+            chosen[member] = target
+    choice[reachable] = chosen
+    return choice
+
+def walk_all(fields, starts, choice):
+    '''
+    Walks every occupant to its assigned exit at once
+    starts: flat padded indices of the occupants
+    choice: exit of each occupant, -1 for none
+    Returns an array with the (x, y) cells of each path where it starts, turns
+    or ends, empty if there is no exit
+    '''
+    starts = np.asarray(starts, dtype=np.int64)
+    exit = np.maximum(choice, 0)
+    length = np.where(choice >= 0, fields.dist[exit, starts], -1)
+    steps = int(length.max(initial=-1))
+    trail = np.empty((max(steps, 0) + 2, starts.size), dtype=np.int64)
+    trail[0] = current = starts
+    for step in range(1, steps + 1):
+        current = np.where(length >= step, fields.next_hop[exit, current], current)
+        trail[step] = current
+    trail[-1] = current
+    # keep the cells where the direction changes, straight runs are implied
+    step = np.diff(trail, axis=0)
+    keep = np.ones(trail.shape, dtype=bool)
+    keep[1:-1] = step[:-1] != step[1:]
+    index = np.arange(trail.shape[0])[:, None]
+    keep &= (index <= length) | (length < 0)
+    keep[:, length < 0] = False
+    keep[length, np.arange(starts.size)] |= length >= 0
+    keep = keep.T
+    width = fields.shape[1] + 2
+    cells = trail.T[keep]
+    cells = np.stack((cells//width - 1, cells%width - 1), axis=1)
+    return np.split(cells, np.cumsum(keep.sum(axis=1))[:-1])
+
+def plan(fields, entries, capacity=None):
+    '''
+    Routes every occupant to an exit without exceeding the exit capacities
+    fields: ExitFields of the floor
+    entries: list of [x, y] locations of the occupants
+    capacity: occupants per exit, one number for all exits or a list in the order
+    of fields.goals, by default unbounded so every occupant takes its nearest exit
+    Returns the exit index of each occupant (-1 if none is reachable), whether
+    its entry is safe and its path as returned by walk_all
+    '''
+    rows, cols = fields.shape
+    entries = np.asarray(entries, dtype=np.int64).reshape(-1, 2)
+    inside = (entries[:, 0] >= 0) & (entries[:, 0] < rows) & (entries[:, 1] >= 0) & (entries[:, 1] < cols)
+    starts = np.where(inside, (entries[:, 0] + 1)*(cols + 2) + entries[:, 1] + 1, 0)
+    safe = inside & fields.passable[starts]
+    exits = len(fields.goals)
+    if not exits:
+        return np.full(entries.shape[0], -1), safe, [np.empty((0, 2), dtype=np.int64)]*entries.shape[0]
+    if capacity is None:
+        capacity = math.inf
+    capacity = np.asarray(capacity, dtype=float)
+    if capacity.ndim and capacity.shape != (exits,):
+        raise ValueError('capacity must be one number or one number per exit')
+    capacity = np.broadcast_to(capacity, (exits,))
+    dist = fields.dist[:, starts[safe]].T
+    choice = np.full(entries.shape[0], -1)
+    choice[safe] = assign(np.where(dist >= 0, dist, math.inf), capacity)
+    return choice, safe, walk_all(fields, starts, choice)
+
+_fields = cache.BoundedCache(max_entries=64)
+
+def building_fields(building, method, fire, floor=0):
+    '''
+    Returns the per exit fields of a building for method (fire, med or extinguisher)
+    '''
+    return _fields.get_or_build((building.id, floor, method), cache.building_token(building, fire),
+                                lambda: build_fields(*maps.method_goals(building, method, floor), fire))
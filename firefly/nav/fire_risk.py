@@ -0,0 +1,64 @@
+'''
+Fire proximity costs for risk weighted routing.
+Every walkable cell costs 1 plus a risk term that grows as the cell gets closer
+to a burning cell, cells in the warning state (2) of simulate_fire pay an extra
+penalty. The cost map is derived from a chessboard distance transform of the
+fire matrix and is cached per fire snapshot, so it is computed once per fire
+update and shared by every request routed against that snapshot.
+'''
+
+import numpy as np
+
+from . import bitbfs
+from . import cache
+
+radius = 5          # cells farther than this from the fire carry no risk
+weight = 4          # extra cost of a cell next to the fire
+warning_weight = 4  # extra cost of a cell in the warning state
+
+def fire_distance(fire, max_distance=radius):
+    '''
+    Chessboard distance from every cell to the nearest burning cell,
+    cells farther than max_distance get max_distance + 1
+    '''
+    burning = np.asarray(fire) == 1
+    distance = bitbfs.distance_layers(np.ones(burning.shape, dtype=bool), burning, max_distance)
+    distance[distance < 0] = max_distance + 1
+    return distance
+
+def cost_map(fire):
+    '''
+    Cost of entering each cell, 1 away from the fire and up to 1 + weight next to it
+    '''
+    fire = np.asarray(fire)
+    proximity = (radius + 1 - fire_distance(fire, radius))/(radius + 1)
+    return 1 + weight*proximity + warning_weight*(fire == 2)
+
+_costs = cache.BoundedCache(max_entries=64)
+
+def _snapshot_costs(fire):
+    '''
+    (padded cost list, risk free mask) of a fire snapshot, computed once per snapshot
+    '''
+    key = (cache.array_digest(fire), radius, weight, warning_weight)
+    cached = _costs.get(key)
+    if cached is None:
+        costs = cost_map(fire)
+        free = costs == 1
+        free.setflags(write=False)
+        cached = (np.pad(costs, 1, constant_values=np.inf).ravel().tolist(), free)
+        _costs.set(key, cached)
+    return cached
+
+def padded_costs(fire):
+    '''
+    Cost map with the one cell border used by PathFinder, flattened to a list,
+    cached against the fire snapshot
+    '''
+    return _snapshot_costs(fire)[0]
+
+def risk_free(fire):
+    '''
+    2D bool mask of the cells that carry no fire risk (cost 1), cached with the cost map
+    '''
+    return _snapshot_costs(fire)[1]
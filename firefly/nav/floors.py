@@ -0,0 +1,156 @@
+'''
+Multi-floor navigation over the whole Building.floor_map.
+All floors are stacked in one contiguous 3D array, padded with a wall border on
+every floor, and searched as a single graph: cells move within a floor as in
+PathFinder, and stair (5) or elevator (6) cells connect to the same cell of the
+floor above or below when that cell is a stair or elevator as well.
+Elevators are left out unless asked for, they are not to be used during a fire.
+'''
+
+import heapq
+import math
+
+import numpy as np
+
+from . import PathFinder
+
+STAIRS = 5
+ELEVATOR = 6
+
+stair_cost = 5       # cost of climbing one floor by stairs, in cells
+elevator_cost = 2    # cost of moving one floor by elevator, in cells
+
+def building_handler(floor_map):
+    '''
+    3D counterpart of PathFinder.map_handler, without loops over cells
+    floor_map: 3D list (floors, rows, cols) with the codes of map_handler plus
+    5 for stairs and 6 for elevators
+    Returns the cleaned grid, the stairs and elevator masks and the
+    fire exits, med kits and extinguishers as [floor, x, y] lists
+    '''
+    grid = np.array(floor_map)
+    fire_exits = np.argwhere(grid == 2).tolist()
+    med_kits = np.argwhere(grid == 3).tolist()
+    extinguishers = np.argwhere(grid == 4).tolist()
+    stairs = grid == STAIRS
+    elevators = grid == ELEVATOR
+    grid = np.where(grid == -1, 0, np.where(grid != 0, 1, 0))
+    return grid, stairs, elevators, fire_exits, med_kits, extinguishers
+
+def _passable(grid, fire):
+    passable = grid != 0
+    if fire is not None:
+        passable &= np.asarray(fire) != 1
+    return passable
+
+def passable_mask(floor_map, fire):
+    '''
+    3D bool mask of the cells that are walkable and not burning
+    '''
+    return _passable(building_handler(floor_map)[0], fire)
+
+def _links(connector, passable, cost):
+    '''
+    Cost of going up and down from each cell through a connector mask, inf if not allowed
+    '''
+    linked = connector & passable
+    both = linked[:-1] & linked[1:]
+    up = np.full(connector.shape, np.inf)
+    down = np.full(connector.shape, np.inf)
+    up[:-1][both] = cost
+    down[1:][both] = cost
+    return up, down
+
+def _pad(array, value):
+    return np.pad(array, ((0, 0), (1, 1), (1, 1)), constant_values=value).ravel()
+
+def route(floor_map, fire, entry, method, use_elevators=False):
+    '''
+    Finds the cheapest route from entry to the nearest goal of method on any floor
+    floor_map: 3D list of floor maps
+    fire: 3D list of fire matrices, 1 is fire
+    entry: [floor, x, y]
+    Returns the list of (floor, x, y) cells, or [] if no goal is reachable,
+    and the 3D passable mask the route was searched on
+    '''
+    grid, stairs, elevators, *goals = building_handler(floor_map)
+    goal_nodes = goals[PathFinder.METHODS.index(method)]
+    floors, rows, cols = grid.shape
+    passable = _passable(grid, fire)
+    up, down = _links(stairs, passable, stair_cost)
+    if use_elevators:
+        elevator_up, elevator_down = _links(elevators, passable, elevator_cost)
+        up, down = np.minimum(up, elevator_up), np.minimum(down, elevator_down)
+    vertical = min(stair_cost, elevator_cost) if use_elevators else stair_cost
+
+    width = cols + 2
+    plane = (rows + 2)*width
+    f, x, y = entry
+    if not (0 <= f < floors and 0 <= x < rows and 0 <= y < cols) or not passable[f, x, y]:
+        raise ValueError('Entry point is not safe')
+    open_cells = _pad(passable, False).tolist()
+    up, down = _pad(up, np.inf).tolist(), _pad(down, np.inf).tolist()
+    moves = list(zip(PathFinder.move_offsets(cols).tolist(), PathFinder.MOVE_COSTS))
+
+    goals = [node for node in goal_nodes if passable[tuple(node)]]
+    if not goals:
+        return [], passable
+    goal_set = set(g*plane + (gx + 1)*width + gy + 1 for g, gx, gy in goals)
+    goal_f, goal_x, goal_y = (np.array(axis) for axis in zip(*goals))
+
+    def heuristic(index):
+        hf, rest = divmod(index, plane)
+        hx, hy = divmod(rest, width)
+        return float((PathFinder.octile_distance(np.abs(goal_x + 1 - hx), np.abs(goal_y + 1 - hy))
+                      + vertical*np.abs(goal_f - hf)).min())
+
+    start = f*plane + (x + 1)*width + y + 1
+    parent = {start: -1}
+    cost = {start: 0.0}
+    closed = set()
+    h = heuristic(start)
+    heap = [(h, h, start)]
+    goal = None
+    while heap:
+        _, _, current = heapq.heappop(heap)
+        if current in closed:
+            continue
+        if current in goal_set:
+            goal = current
+            break
+        closed.add(current)
+        current_cost = cost[current]
+        steps = [(current + offset, step) for offset, step in moves]
+        steps.append((current + plane, up[current]))
+        steps.append((current - plane, down[current]))
+        for child, step in steps:
+            if step == math.inf or not open_cells[child] or child in closed:
+                continue
+            new_cost = current_cost + step
+            if new_cost < cost.get(child, math.inf):
+                cost[child] = new_cost
+                parent[child] = current
+                h = heuristic(child)
+                heapq.heappush(heap, (new_cost + h, h, child))
+    if goal is None:
+        return [], passable
+    path = []
+    while goal >= 0:
+        cf, rest = divmod(goal, plane)
+        cx, cy = divmod(rest, width)
+        path.append((cf, cx - 1, cy - 1))
+        goal = parent[goal]
+    return path[::-1], passable
+
+def floor_segments(path, passable, transform=None):
+    '''
+    Splits a 3D path into consecutive per-floor segments of [lon, lat] points
+    passable: 3D bool mask from route or passable_mask, used to smooth each segment
+    transform: georeference of the floors, see PathFinder.georeference
+    '''
+    segments = []
+    for f, x, y in path:
+        if not segments or segments[-1][0] != f:
+            segments.append((f, []))
+        segments[-1][1].append((x, y))
+    return [{'floor': f, 'path': PathFinder.format_path(cells, passable[f], transform)} for f, cells in segments]
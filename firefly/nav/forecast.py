@@ -0,0 +1,28 @@
+'''
+Cached fire spread forecasts used by fire-aware routing.
+A forecast is the per-cell ignition step array predicted by simulate_fire from
+the current fire matrix of a floor, so routes can avoid cells that will be
+burning by the time the occupant reaches them.
+'''
+
+import numpy as np
+
+from . import cache
+from . import simulate_fire
+
+_forecasts = cache.BoundedCache(max_entries=64)
+
+def building_ignition(building, fire, floor=0, steps=50):
+    '''
+    Returns the predicted ignition steps of a floor
+    fire: current fire matrix of the floor
+    steps: forecast horizon in simulation steps
+    '''
+    def build():
+        grid = np.asarray(fire)
+        if building.tti:
+            tti = np.asarray(building.tti[floor])
+        else:
+            tti = np.random.randint(1, simulate_fire.max_tti, size=grid.shape)
+        return simulate_fire.forecast_ignition(grid, tti, steps=steps)
+    return _forecasts.get_or_build((building.id, floor, steps), cache.building_token(building, fire), build)
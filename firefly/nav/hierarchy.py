@@ -0,0 +1,378 @@
+'''
+Hierarchical path finding (HPA*) for large grids.
+The grid is split into square clusters. Entrances are placed on the borders
+between neighbouring clusters, and the distances between the entrances (and
+goal nodes) of a cluster are precomputed, which gives a small abstract graph.
+A query connects the entry to the entrances of its cluster, searches the
+abstract graph with A* (octile distance to the closest goal) and refines only
+the clusters on the abstract path with A* inside each cluster, so its cost
+follows the abstract nodes near the route and the cluster size, not the grid area.
+When the fire changes only the clusters containing changed cells and their
+neighbours are recomputed.
+Moves cost 1 / sqrt(2) as in the astar mode of PathFinder, routes are within a
+few percent of the shortest.
+'''
+
+import heapq
+import math
+import threading
+
+import numpy as np
+
+from . import PathFinder
+from . import cache
+from . import maps
+
+SQRT2 = math.sqrt(2)
+long_entrance = 6      # runs of open border cells at least this long get two entrances
+batch_clusters = 256   # clusters whose distances are computed in one numpy batch
+
+class Hierarchy:
+    '''
+    grid: 2D array where 0 is a wall
+    goal_nodes: list of [x, y] goal cells
+    fire: 2D array, 1 marks a burning cell
+    cluster_size: side of a cluster in cells
+    '''
+    def __init__(self, grid, goal_nodes, fire=None, cluster_size=16):
+        self.walls = np.asarray(grid) == 0
+        self.shape = self.walls.shape
+        self.size = cluster_size
+        self.goals = frozenset(tuple(node) for node in goal_nodes if PathFinder.is_valid(self.walls, node))
+        self.passable = self._passable(fire)
+        self.to_goal = PathFinder._goal_heuristic(self.goals, self.shape) if self.goals else None
+        self.goal_distance = {}
+        self.cluster_rows = -(-self.shape[0]//cluster_size)
+        self.cluster_cols = -(-self.shape[1]//cluster_size)
+        self.lock = threading.Lock()
+        self.borders = {}
+        self.clusters = {}
+        ids = [(cr, cc) for cr in range(self.cluster_rows) for cc in range(self.cluster_cols)]
+        for cid in ids:
+            for other in self._neighbours(cid):
+                if other > cid:
+                    self.borders[(cid, other)] = self._border(cid, other)
+        self._build_clusters({cid: self._links(cid) for cid in ids})
+
+    def _passable(self, fire):
+        passable = ~self.walls
+        if fire is not None:
+            passable &= np.asarray(fire) != 1
+        return passable
+
+    def _cluster_of(self, cell):
+        return (cell[0]//self.size, cell[1]//self.size)
+
+    def _bounds(self, cid):
+        cr, cc = cid
+        return (cr*self.size, min((cr + 1)*self.size, self.shape[0]),
+                cc*self.size, min((cc + 1)*self.size, self.shape[1]))
+
+    def _neighbours(self, cid):
+        cr, cc = cid
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                if (dr or dc) and 0 <= cr + dr < self.cluster_rows and 0 <= cc + dc < self.cluster_cols:
+                    yield (cr + dr, cc + dc)
+
+    def _border(self, a, b):
+        '''
+        Transitions (cell in a, cell in b, cost) between two neighbouring clusters, b > a.
+        Each run of facing open cells gets one transition in its middle, or one at
+        each end if it is long; a diagonal step gets its own transition only where
+        no straight crossing is next to it
+        '''
+        P = self.passable
+        dr, dc = b[0] - a[0], b[1] - a[1]
+        x0, x1, y0, y1 = self._bounds(a)
+        if dr and dc:
+            # clusters touching at a corner
+            ax, ay = x1 - 1, (y1 - 1 if dc == 1 else y0)
+            bx, by = ax + 1, ay + dc
+            return [((ax, ay), (bx, by), SQRT2)] if P[ax, ay] and P[bx, by] else []
+        if dc:
+            # vertical border, a on the left
+            line = [((x, y1 - 1), (x, y1)) for x in range(x0, x1)]
+        else:
+            # horizontal border, a on top
+            line = [((x1 - 1, y), (x1, y)) for y in range(y0, y1)]
+        straight = [bool(P[ca] and P[cb]) for ca, cb in line]
+        transitions = []
+        start = None
+        for k, open_pair in enumerate(straight + [False]):
+            if open_pair and start is None:
+                start = k
+            elif not open_pair and start is not None:
+                ends = (start, k - 1) if k - start >= long_entrance else ((start + k - 1)//2,)
+                transitions.extend((*line[end], 1.0) for end in ends)
+                start = None
+        for k in range(len(line) - 1):
+            if straight[k] or straight[k + 1]:
+                continue
+            (a0, b0), (a1, b1) = line[k], line[k + 1]
+            if P[a0] and P[b1]:
+                transitions.append((a0, b1, SQRT2))
+            if P[a1] and P[b0]:
+                transitions.append((a1, b0, SQRT2))
+        return transitions
+
+    def _links(self, cid):
+        '''
+        Entrances of a cluster mapped to the nodes they lead to in neighbouring clusters
+        '''
+        links = {}
+        for other in self._neighbours(cid):
+            key = (cid, other) if other > cid else (other, cid)
+            for ca, cb, cost in self.borders[key]:
+                mine, theirs = (ca, cb) if other > cid else (cb, ca)
+                links.setdefault(mine, []).append((theirs, cost))
+        return links
+
+    def _build_clusters(self, links):
+        '''
+        Sets the entrance and goal nodes of the given clusters, their links to nodes
+        of neighbouring clusters and the precomputed distances between their own nodes
+        links: dict of cluster id to the links of the cluster (see _links)
+        '''
+        nodes = {}
+        for cid, cluster_links in links.items():
+            x0, x1, y0, y1 = self._bounds(cid)
+            cluster_nodes = set(cluster_links)
+            cluster_nodes.update(goal for goal in self.goals
+                                 if x0 <= goal[0] < x1 and y0 <= goal[1] < y1 and self.passable[goal])
+            nodes[cid] = sorted(cluster_nodes)
+        # clusters with as many nodes share a batch, so little of it is padding
+        ids = sorted(links, key=lambda cid: len(nodes[cid]))
+        for chunk in range(0, len(ids), batch_clusters):
+            batch = ids[chunk:chunk + batch_clusters]
+            distances = self._cluster_distances(batch, [nodes[cid] for cid in batch])
+            for cid, dist in zip(batch, distances):
+                cluster_nodes = nodes[cid]
+                edges = {}
+                for k, node in enumerate(cluster_nodes):
+                    edges[node] = [(other, float(dist[k, j])) for j, other in enumerate(cluster_nodes)
+                                   if j != k and dist[k, j] < math.inf]
+                self.clusters[cid] = {'nodes': frozenset(cluster_nodes), 'links': links[cid], 'edges': edges}
+
+    def _cluster_distances(self, cids, nodes):
+        '''
+        Distances between all pairs of nodes inside each cluster. The distance maps
+        of every node of every cluster in the batch are relaxed together with
+        shifted numpy slices until nothing changes, which gives exact octile
+        shortest paths without a Python loop over cells
+        Returns one (nodes, nodes) array per cluster
+        '''
+        side = self.size + 2
+        most = max([len(cluster_nodes) for cluster_nodes in nodes] + [1])
+        blocked = np.ones((len(cids), side, side), dtype=bool)
+        dist = np.full((len(cids), most, side, side), np.inf)
+        for c, (cid, cluster_nodes) in enumerate(zip(cids, nodes)):
+            x0, x1, y0, y1 = self._bounds(cid)
+            blocked[c, 1:x1 - x0 + 1, 1:y1 - y0 + 1] = ~self.passable[x0:x1, y0:y1]
+            for k, (x, y) in enumerate(cluster_nodes):
+                dist[c, k, x - x0 + 1, y - y0 + 1] = 0
+        # inf on blocked cells and 0 elsewhere, taking the maximum keeps blocked cells unreachable
+        walls = np.where(blocked, np.inf, 0)[:, None]
+        # only the clusters that changed in the last round are relaxed again
+        active = np.arange(len(cids))
+        while active.size:
+            current = dist[active]
+            relaxed = current.copy()
+            for (dx, dy), step in zip(PathFinder.MOVES, PathFinder.MOVE_COSTS):
+                target = relaxed[..., max(dx, 0):side + min(dx, 0), max(dy, 0):side + min(dy, 0)]
+                source = current[..., max(-dx, 0):side - max(dx, 0), max(-dy, 0):side - max(dy, 0)]
+                np.minimum(target, source + step, out=target)
+            np.maximum(relaxed, walls[active], out=relaxed)
+            changed = (relaxed != current).any(axis=(1, 2, 3))
+            dist[active] = relaxed
+            active = active[changed]
+        result = []
+        for c, (cid, cluster_nodes) in enumerate(zip(cids, nodes)):
+            x0, _, y0, _ = self._bounds(cid)
+            rows = [x - x0 + 1 for x, _ in cluster_nodes]
+            cols = [y - y0 + 1 for _, y in cluster_nodes]
+            result.append(dist[c, :len(cluster_nodes)][:, rows, cols])
+        return result
+
+    def _local_search(self, cid, source, targets):
+        '''
+        Dijkstra restricted to one cluster, stops once every reachable target is settled
+        Returns the distances and parents of the settled cells
+        '''
+        x0, x1, y0, y1 = self._bounds(cid)
+        P = self.passable
+        dist, parent = {source: 0.0}, {source: None}
+        remaining = set(targets)
+        remaining.discard(source)
+        done = set()
+        heap = [(0.0, source)]
+        while heap:
+            d, current = heapq.heappop(heap)
+            if current in done:
+                continue
+            done.add(current)
+            remaining.discard(current)
+            if not remaining:
+                break
+            for (dx, dy), step in zip(PathFinder.MOVES, PathFinder.MOVE_COSTS):
+                child = (current[0] + dx, current[1] + dy)
+                if not (x0 <= child[0] < x1 and y0 <= child[1] < y1) or not P[child] or child in done:
+                    continue
+                if d + step < dist.get(child, math.inf):
+                    dist[child] = d + step
+                    parent[child] = current
+                    heapq.heappush(heap, (d + step, child))
+        return {cell: dist[cell] for cell in done}, parent
+
+    def _local_path(self, cid, source, target):
+        '''
+        A* restricted to one cluster, the cells from source to target
+        '''
+        x0, x1, y0, y1 = self._bounds(cid)
+        P = self.passable
+        tx, ty = target
+
+        def heuristic(cell):
+            dx, dy = abs(cell[0] - tx), abs(cell[1] - ty)
+            return max(dx, dy) + (SQRT2 - 1)*min(dx, dy)
+
+        dist, parent = {source: 0.0}, {source: None}
+        done = set()
+        heap = [(heuristic(source), 0.0, source)]
+        while heap:
+            _, d, current = heapq.heappop(heap)
+            if current == target:
+                break
+            if current in done:
+                continue
+            done.add(current)
+            for (dx, dy), step in zip(PathFinder.MOVES, PathFinder.MOVE_COSTS):
+                child = (current[0] + dx, current[1] + dy)
+                if not (x0 <= child[0] < x1 and y0 <= child[1] < y1) or not P[child] or child in done:
+                    continue
+                if d + step < dist.get(child, math.inf):
+                    dist[child] = d + step
+                    parent[child] = current
+                    heapq.heappush(heap, (d + step + heuristic(child), d + step, child))
+        path = []
+        while target is not None:
+            path.append(target)
+            target = parent[target]
+        return path[::-1]
+
+    def update(self, fire):
+        '''
+        Recomputes only the clusters affected by cells whose fire state changed
+        '''
+        with self.lock:
+            self._update(fire)
+
+    def _update(self, fire):
+        passable = self._passable(fire)
+        changed = np.argwhere(passable != self.passable)
+        if not changed.size:
+            return
+        self.passable = passable
+        dirty = set(self._cluster_of(cell) for cell in changed.tolist())
+        affected = set(dirty)
+        for cid in dirty:
+            for other in self._neighbours(cid):
+                affected.add(other)
+                key = (cid, other) if other > cid else (other, cid)
+                self.borders[key] = self._border(*key)
+        rebuild = {}
+        for cid in affected:
+            links = self._links(cid)
+            old = self.clusters[cid]
+            if cid not in dirty and set(links) | (old['nodes'] - set(old['links'])) == old['nodes']:
+                # the inside of the cluster and its entrances are unchanged, keep its distances
+                self.clusters[cid] = {'nodes': old['nodes'], 'links': links, 'edges': old['edges']}
+            else:
+                rebuild[cid] = links
+        self._build_clusters(rebuild)
+
+    def path(self, entry):
+        '''
+        Returns the (x, y) cells from entry to the nearest goal, or [] if none is reachable
+        '''
+        with self.lock:
+            return self._path(tuple(entry))
+
+    def route(self, entry, fire):
+        '''
+        Brings the hierarchy to fire and returns path(entry) with the 2D passable
+        mask it was searched on, under one lock so concurrent requests on other
+        fire matrices cannot change the hierarchy in between
+        '''
+        with self.lock:
+            self._update(fire)
+            return self._path(tuple(entry)), self.passable
+
+    def _heuristic(self, node):
+        '''
+        Octile distance from a node to the closest goal, remembered per node as the goals never change
+        '''
+        h = self.goal_distance.get(node)
+        if h is None:
+            h = self.goal_distance[node] = self.to_goal(PathFinder.to_index(node, self.shape))
+        return h
+
+    def _path(self, entry):
+        if not PathFinder.is_valid(self.walls, entry) or not self.passable[entry]:
+            raise ValueError('Entry point is not safe')
+        if entry in self.goals:
+            return [entry]
+        if not self.goals:
+            return []
+        start_cluster = self._cluster_of(entry)
+        dist, _ = self._local_search(start_cluster, entry, self.clusters[start_cluster]['nodes'])
+        # A* over the abstract graph, every edge is at least as long as the octile
+        # distance between its ends, so the heuristic is consistent
+        heuristic = self._heuristic
+        cost = {node: d for node, d in dist.items() if node in self.clusters[start_cluster]['nodes']}
+        parent = {node: entry for node in cost}
+        heap = [(d + heuristic(node), d, node) for node, d in cost.items()]
+        heapq.heapify(heap)
+        done = set()
+        goal = None
+        while heap:
+            _, d, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            if node in self.goals:
+                goal = node
+                break
+            done.add(node)
+            cluster = self.clusters[self._cluster_of(node)]
+            for other, step in cluster['edges'].get(node, []) + cluster['links'].get(node, []):
+                if other not in done and d + step < cost.get(other, math.inf):
+                    cost[other] = d + step
+                    parent[other] = node
+                    heapq.heappush(heap, (d + step + heuristic(other), d + step, other))
+        if goal is None:
+            return []
+        abstract = [goal]
+        while abstract[-1] != entry:
+            abstract.append(parent[abstract[-1]])
+        abstract.reverse()
+        path = [entry]
+        for source, target in zip(abstract, abstract[1:]):
+            cid = self._cluster_of(source)
+            if cid == self._cluster_of(target):
+                path.extend(self._local_path(cid, source, target)[1:])
+            else:
+                path.append(target)
+        return path
+
+_hierarchies = cache.BoundedCache(max_entries=64)
+
+def building_hierarchy(building, method, fire, floor=0, cluster_size=16):
+    '''
+    Returns the hierarchy of a building floor for method, built once per floor map
+    and goals, fire changes are applied by Hierarchy.route
+    '''
+    grid, goal_nodes = maps.method_goals(building, method, floor)
+    # saving a new fire matrix also moves updated_at, so the map itself is the token
+    token = (cache.array_digest(grid), tuple(map(tuple, goal_nodes)))
+    return _hierarchies.get_or_build((building.id, floor, method, cluster_size), token,
+                                     lambda: Hierarchy(grid, goal_nodes, fire, cluster_size))
@@ -0,0 +1,39 @@
+'''
+Cleaned floor maps cached per building.
+The output of PathFinder.map_handler (walkable grid and goal coordinates) only
+changes when the Building row is saved, so it is cached against
+Building.updated_at instead of being recomputed on every request.
+'''
+
+from . import PathFinder
+from . import cache
+
+_maps = cache.BoundedCache(max_entries=256)
+
+def building_map(building, floor=0):
+    '''
+    Returns map_handler's (grid, fire_exits, med_kits, extinguishers) for a floor,
+    the grid is shared between requests and read only
+    '''
+    def build():
+        handled = PathFinder.map_handler(building.floor_map[floor])
+        handled[0].setflags(write=False)
+        return handled
+    return _maps.get_or_build((building.id, floor), building.updated_at, build)
+
+def method_goals(building, method, floor=0):
+    '''
+    Returns the cleaned grid of a floor and the goal nodes of method (fire, med or extinguisher)
+    '''
+    grid, *goals = building_map(building, floor)
+    return grid, goals[PathFinder.METHODS.index(method)]
+
+def georeference(building, shape):
+    '''
+    Returns the affine transform of the building's grid, falling back to the
+    default bounds of PathFinder when the building has none
+    shape: (rows, cols) of the floor grid
+    '''
+    if building.georeference:
+        return building.georeference
+    return PathFinder.georeference(shape)
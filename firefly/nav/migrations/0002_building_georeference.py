@@ -0,0 +1,17 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nav', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='building',
+            name='georeference',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, null=True, size=6),
+        ),
+    ]
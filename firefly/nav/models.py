@@ -42,6 +42,13 @@ class Building(models.Model):
         blank=True,
         null=True
     )
+    # affine transform [a, b, c, d, e, f] from cell (i, j) to lon = a*i + b*j + c, lat = d*i + e*j + f
+    georeference = ArrayField(
+        models.FloatField(),
+        size=6,
+        blank=True,
+        null=True
+    )
     city = models.CharField(max_length=100, blank=True, null=True)
     state = models.CharField(max_length=100, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,205 @@
+'''
+Incremental re-planning for navigation sessions.
+A session keeps a D* Lite planner that searches backwards from the goal nodes,
+so when cells catch fire or the user moves only the part of the search affected
+by the change is repaired instead of running path_finder from scratch.
+Moves cost 1 / sqrt(2) as in the astar mode of PathFinder.
+Sessions on the same building and fire snapshot share its passable mask, and
+sessions are dropped least recently used first once their estimated search
+state exceeds session_bytes.
+'''
+
+import heapq
+from array import array
+import math
+import threading
+import uuid
+
+import numpy as np
+
+from . import PathFinder
+from . import cache
+from . import maps
+
+class Planner:
+    '''
+    D* Lite over the padded flat cell indices used by PathFinder
+    passable: padded flat bool mask (PathFinder.padded_mask), read only
+    goals: flat indices of the goal nodes
+    start: flat index of the user's cell
+    open_cells: passable as a list, never modified, so sessions on the same snapshot can share it
+    '''
+    def __init__(self, passable, shape, goals, start, open_cells=None):
+        self.shape = shape
+        self.width = shape[1] + 2
+        self.passable = passable
+        self.open = passable.tolist() if open_cells is None else open_cells
+        self.moves = list(zip(PathFinder.move_offsets(shape[1]).tolist(), PathFinder.MOVE_COSTS))
+        self.goals = frozenset(goals)
+        self.start = self.last = start
+        self.km = 0.0
+        # plain doubles, 16 bytes a cell, instead of dicts of float objects
+        self.g = array('d', [math.inf])*len(self.open)
+        self.rhs = array('d', [math.inf])*len(self.open)
+        self.heap, self.queued = [], {}
+        self.lock = threading.Lock()
+        for goal in self.goals:
+            self._update_vertex(goal)
+        self._compute()
+
+    def _h(self, a, b):
+        ax, ay = divmod(a, self.width)
+        bx, by = divmod(b, self.width)
+        dx, dy = abs(ax - bx), abs(ay - by)
+        return max(dx, dy) + (math.sqrt(2) - 1)*min(dx, dy)
+
+    def _key(self, u):
+        # rounded so that sums of sqrt(2) steps taken in a different order compare equal
+        m = min(self.g[u], self.rhs[u])
+        return (round(m + self._h(self.start, u) + self.km, 9), round(m, 9))
+
+    def _update_vertex(self, u):
+        if not self.open[u]:
+            rhs = math.inf
+        elif u in self.goals:
+            rhs = 0.0
+        else:
+            g = self.g
+            rhs = min((step + g[u + offset] for offset, step in self.moves if self.open[u + offset]),
+                      default=math.inf)
+        self.rhs[u] = rhs
+        if self.g[u] != rhs:
+            key = self._key(u)
+            self.queued[u] = key
+            heapq.heappush(self.heap, (key, u))
+        else:
+            self.queued.pop(u, None)
+
+    def _update_neighbours(self, u):
+        for offset, _ in self.moves:
+            if self.open[u + offset]:
+                self._update_vertex(u + offset)
+
+    def _compute(self):
+        heap, queued = self.heap, self.queued
+        while heap:
+            key, u = heap[0]
+            if queued.get(u) != key:
+                heapq.heappop(heap)
+                continue
+            if key >= self._key(self.start) and self.rhs[self.start] == self.g[self.start]:
+                break
+            heapq.heappop(heap)
+            del queued[u]
+            new_key = self._key(u)
+            g, rhs = self.g[u], self.rhs[u]
+            if key < new_key:
+                queued[u] = new_key
+                heapq.heappush(heap, (new_key, u))
+            elif g > rhs:
+                self.g[u] = rhs
+                self._update_neighbours(u)
+            else:
+                self.g[u] = math.inf
+                self._update_vertex(u)
+                self._update_neighbours(u)
+        if len(heap) > 2*len(queued):
+            # drop the stale entries left behind by requeued cells, they only hold memory
+            self.heap = [(key, u) for u, key in queued.items()]
+            heapq.heapify(self.heap)
+
+    def update(self, passable, start, open_cells=None):
+        '''
+        Repairs the search after the passable mask changed and/or the user moved
+        passable, open_cells: the current snapshot, as in the constructor
+        '''
+        if start != self.start:
+            self.km += self._h(self.last, start)
+            self.last = self.start = start
+        if passable is self.passable:
+            changed = np.empty(0, dtype=np.int64)
+        else:
+            changed = np.flatnonzero(passable != self.passable)
+            self.passable = passable
+            self.open = passable.tolist() if open_cells is None else open_cells
+        for u in changed.tolist():
+            self._update_vertex(u)
+            self._update_neighbours(u)
+        self._compute()
+
+    def path(self):
+        '''
+        Returns the (x, y) cells from start to the nearest goal, or [] if none is reachable
+        '''
+        current = self.start
+        if self.g[current] == math.inf:
+            return []
+        path = [current]
+        while current not in self.goals and len(path) <= len(self.open):
+            best, best_cost = None, math.inf
+            for offset, step in self.moves:
+                child = current + offset
+                cost = step + self.g[child]
+                if self.open[child] and cost < best_cost:
+                    best, best_cost = child, cost
+            if best is None:
+                return []
+            current = best
+            path.append(current)
+        return [PathFinder.to_coordinates(index, self.shape) for index in path]
+
+    def nbytes(self):
+        '''
+        Rough size in bytes of the search state of this planner, the shared snapshot excluded
+        '''
+        # g and rhs, a queued dict entry with its key tuple, and a heap entry
+        return self.g.itemsize*(len(self.g) + len(self.rhs)) + 150*len(self.queued) + 80*len(self.heap)
+
+session_bytes = 256*2**20   # search state kept for all sessions, least recently used ones are dropped first
+
+_sessions = cache.BoundedCache(max_entries=2**20, max_bytes=session_bytes)
+_snapshots = cache.BoundedCache(max_entries=64)
+
+def _snapshot(building, grid, fire, floor):
+    '''
+    Padded passable mask of a floor and the same mask as a list, shared by every
+    session on the same building and fire snapshot
+    '''
+    def build():
+        passable = PathFinder.padded_mask(grid, fire)
+        passable.setflags(write=False)
+        return passable, passable.tolist()
+    return _snapshots.get_or_build((building.id, floor), cache.building_token(building, fire), build)
+
+def session_path(session, building, method, fire, entry, floor=0):
+    '''
+    Returns the session id, the path of the user and the 2D passable mask,
+    re-planning incrementally when the session already exists for the same
+    building, method and goals
+    session: id returned by a previous call or None to start a new session, a new id
+    is issued when it does not match a session on the same building, floor and method
+    '''
+    grid, goal_nodes = maps.method_goals(building, method, floor)
+    if not PathFinder.is_safe(grid, entry, np.asarray(fire)):
+        raise ValueError('Entry point is not safe')
+    shape = grid.shape
+    passable, open_cells = _snapshot(building, grid, fire, floor)
+    goals = [PathFinder.to_index(node, shape) for node in goal_nodes]
+    start = PathFinder.to_index(entry, shape)
+    state = _sessions.get(session) if session is not None else None
+    if state is not None and state[0] == (building.id, floor, method) and state[1].goals == frozenset(goals) \
+            and state[1].shape == shape:
+        planner = state[1]
+        with planner.lock:
+            planner.update(passable, start, open_cells)
+            path = planner.path()
+            size = planner.nbytes()
+    else:
+        # a new id even when the client sent one, so an unknown or mismatched id never takes over a session
+        session = uuid.uuid4().hex
+        planner = Planner(passable, shape, goals, start, open_cells)
+        path = planner.path()
+        size = planner.nbytes()
+    # set again after every update, so the cache sees the size of the repaired search
+    _sessions.set(session, ((building.id, floor, method), planner), size)
+    return session, path, PathFinder.unpad(passable, shape)
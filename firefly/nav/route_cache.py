@@ -0,0 +1,30 @@
+'''
+Shared cache of GET /nav responses.
+Kiosks and fixed beacons ask for the same routes over and over, so responses
+are cached per building, keyed by the query (entry, method, mode and options)
+under the building's snapshot: Building.updated_at and an md5 of its fire
+matrix, both read by a query that leaves the arrays in the database. When the
+snapshot of a building changes all its cached routes are dropped.
+'''
+
+from django.db.models import TextField
+from django.db.models.functions import Cast, MD5
+
+from . import cache
+from . import models
+
+routes = cache.SnapshotCache(max_bytes=32*2**20)
+
+def building_version(id):
+    '''
+    Returns (updated_at, md5 of the fire matrix) of a building, or None if it does not exist
+    '''
+    fire_digest = MD5(Cast('fire_matrix', output_field=TextField()))
+    return models.Building.objects.filter(id=id).annotate(fire_digest=fire_digest) \
+        .values_list('updated_at', 'fire_digest').first()
+
+def query_key(params):
+    '''
+    Key of a query from its parameters, the building id excluded
+    '''
+    return tuple(sorted((name, params.get(name)) for name in params if name != 'id'))
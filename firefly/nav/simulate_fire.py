@@ -9,15 +9,18 @@ max_tti: maximum time to ignition of a cell, a hyperparameter to standardize the
 '''
 
 import numpy as np
-import random
+from concurrent.futures import ProcessPoolExecutor
 
 max_tti = 500
 
-def initialize_grid(ignite_cell, shape=(15,26)):
+def initialize_grid(ignite_cell, shape=(15,26), rng=None):
     start_x, start_y = ignite_cell
     grid = np.zeros(shape)
     # not-burning-0, burning-1, burnt-2, protected-3, barrier-4 for future implementation
-    tti = np.random.randint(1, max_tti, size=shape)
+    if rng is None:
+        tti = np.random.randint(1, max_tti, size=shape)
+    else:
+        tti = rng.integers(1, max_tti, size=shape)
     grid[start_x][start_y] = 1
     return grid, tti
 
@@ -58,25 +61,213 @@ def spread_probability(grid, coordinates, tti, neighbour_factors, alpha=1, beta=
     prob = 1 - np.exp(-alpha*(1 + near + far)*tti_val)
     return prob
 
-def update_grid(grid, tti, alpha=1, beta=0.5, gamma=0.1, warn_threshold=0.8):
+def window_count(mask, radius):
+    '''
+    Number of true cells in the (2*radius+1) square window around every cell,
+    a box convolution computed from a summed area table over the last two axes
+    '''
+    size = 2*radius + 1
+    rows, cols = mask.shape[-2:]
+    table = np.zeros(mask.shape[:-2] + (rows + size, cols + size), dtype=np.int32)
+    padding = [(0, 0)]*(mask.ndim - 2) + [(radius, radius)]*2
+    table[..., 1:, 1:] = np.pad(mask, padding).cumsum(axis=-2).cumsum(axis=-1)
+    return (table[..., size:, size:] - table[..., :-size, size:]
+            - table[..., size:, :-size] + table[..., :-size, :-size])
+
+def neighbour_factors(grid):
+    '''
+    neighbour_factor of every cell at once, as (near, far) arrays
+    '''
+    burning = grid == 1
+    inner = window_count(burning, 1)
+    outer = window_count(burning, 2)
+    # neighbour_factor counts the 3x3 window twice
+    return inner + inner, outer - inner
+
+def spread_probabilities(tti, neighbour_factors, alpha=1, beta=0.5):
+    '''
+    spread_probability of every cell at once
+    '''
+    near, far = neighbour_factors
+    return 1 - np.exp(-alpha*(1 + near/8 + beta*(far/16))*(np.asarray(tti)/max_tti))
+
+def update_grid(grid, tti, alpha=1, beta=0.5, gamma=0.1, warn_threshold=0.8, rng=None):
+    '''
+    One step of the simulation over the whole grid, or over a stack of
+    independent grids (realizations, rows, cols).
+    Every burning neighbour of a non burning cell is one trial with probability
+    gamma*p of igniting it, a failed trial marks it as warning (2) when gamma*p is
+    at least warn_threshold, and the last trial decides. So a cell with
+    gamma*p >= warn_threshold ends burning with probability gamma*p and warning
+    otherwise, and any other cell ignites with probability 1 - (1 - gamma*p)^n,
+    n being its number of burning neighbours.
+    rng: numpy Generator to draw from, the global numpy random state by default
+    '''
     updated = grid.copy()
-    rows, cols = grid.shape
-    for i in range(rows):
-        for j in range(cols):
-            if grid[i][j] == 1:
-                for dx in range(-1, 2):
-                    for dy in range(-1, 2):
-                        child_x, child_y = i+dx, j+dy
-                        if is_valid(grid, (child_x, child_y)) and grid[child_x][child_y] == 0:
-                            neighbour_factors = neighbour_factor(grid, (child_x, child_y))
-                            prob = spread_probability(grid, (child_x, child_y), tti, neighbour_factors, alpha, beta)
-                            if random.random() < gamma*prob:
-                                updated[child_x][child_y] = 1
-                            elif gamma*prob >= warn_threshold:
-                                updated[child_x][child_y] = 2
+    burning = grid == 1
+    rows = np.flatnonzero(burning.any(axis=-1).reshape(-1, grid.shape[-2]).any(axis=0))
+    cols = np.flatnonzero(burning.any(axis=-2).reshape(-1, grid.shape[-1]).any(axis=0))
+    if not rows.size:
+        return updated
+    # only cells next to the fire can change, and their windows only see burning cells
+    window = (Ellipsis, slice(max(rows[0] - 1, 0), rows[-1] + 2), slice(max(cols[0] - 1, 0), cols[-1] + 2))
+    burning = burning[window]
+    inner = window_count(burning, 1)
+    candidates = np.nonzero((grid[window] == 0) & (inner > 0))
+    burning_neighbours = inner[candidates]
+    # neighbour_factor counts the 3x3 window twice
+    far = window_count(burning, 2)[candidates] - burning_neighbours
+    tti = np.broadcast_to(tti, grid.shape)[window][candidates]
+    chance = gamma*spread_probabilities(tti, (2*burning_neighbours, far), alpha, beta)
+    warned = chance >= warn_threshold
+    ignition = np.where(warned, chance, 1 - (1 - chance)**burning_neighbours)
+    ignites = (np.random if rng is None else rng).random(chance.size) < ignition
+    local = updated[window]
+    local[candidates] = np.where(ignites, 1, np.where(warned, 2, 0))
     return updated
 
-def simulate_fire(ignite_cell, shape, alpha=1, beta=0.5, gamma=0.1, steps=50, warn_threshold=0.8, grid=None, tti=None):
+def _offsets(width, radius):
+    '''
+    Flat offsets of the (2*radius+1) square window in a grid of rows width wide
+    '''
+    span = np.arange(-radius, radius + 1)
+    return (span[:, None]*width + span[None, :]).ravel()
+
+def frontier_steps(grid, tti, alpha=1, beta=0.5, gamma=0.1, steps=50, warn_threshold=0.8, rng=None):
+    '''
+    Event driven form of repeated update_grid calls, touching only the fire front.
+    The non burning cells next to a burning cell (the only ones update_grid can
+    change) are kept as a set, with the number of burning cells in their 3x3 and
+    5x5 windows kept as counts that each new ignition adds to. A step evaluates
+    the same spread_probability model over that set alone and updates the counts
+    around the cells it ignites, so its cost follows the perimeter of the fire
+    instead of the size of the floor, and no grid is copied.
+    grid: 2D start state, 0 - not burning, 1 - burning, 2 - warning
+    tti: 2D time to ignition of each cell
+    rng: numpy Generator to draw from, the global numpy random state by default
+    Yields: for each of the steps - 1 steps, the (x, y) cells that started
+    burning and the (x, y) cells that became warnings, as (n, 2) int arrays.
+    Stops early once no cell is left next to the fire, nothing can change after that
+    '''
+    grid = np.asarray(grid)
+    rows, cols = grid.shape
+    width = cols + 4
+    # two cells of padding hold the 5x5 windows of edge cells, 3 marks them as off the grid
+    state = np.full((rows + 4, width), 3, dtype=np.int8)
+    state[2:-2, 2:-2] = grid
+    state = state.ravel()
+    burning = (state == 1).reshape(rows + 4, width)
+    inner = window_count(burning, 1).ravel()
+    outer = window_count(burning, 2).ravel()
+    time = np.zeros(state.size)
+    time.reshape(rows + 4, width)[2:-2, 2:-2] = tti
+    near_offsets, far_offsets = _offsets(width, 1), _offsets(width, 2)
+    neighbours = near_offsets[near_offsets != 0]
+    front = np.flatnonzero((state == 0) & (inner > 0))
+    draw = (np.random if rng is None else rng).random
+    for _ in range(1, steps):
+        if not front.size:
+            return
+        burning_neighbours = inner[front]
+        far = outer[front] - burning_neighbours
+        # neighbour_factor counts the 3x3 window twice
+        chance = gamma*spread_probabilities(time[front], (2*burning_neighbours, far), alpha, beta)
+        warned = chance >= warn_threshold
+        ignition = np.where(warned, chance, 1 - (1 - chance)**burning_neighbours)
+        ignites = draw(front.size) < ignition
+        ignited, warned = front[ignites], front[warned & ~ignites]
+        state[ignited] = 1
+        state[warned] = 2
+        # all of the front is evaluated before the counts see this step's ignitions
+        # the ignited cells are distinct, so no index repeats within one offset
+        for offset in near_offsets:
+            inner[ignited + offset] += 1
+        for offset in far_offsets:
+            outer[ignited + offset] += 1
+        reached = (ignited[:, None] + neighbours).ravel()
+        front = np.union1d(front[state[front] == 0], reached[state[reached] == 0])
+        yield (np.stack(np.divmod(ignited, width), axis=1) - 2,
+               np.stack(np.divmod(warned, width), axis=1) - 2)
+
+def simulate_frontier(ignite_cell, shape, alpha=1, beta=0.5, gamma=0.1, steps=50, warn_threshold=0.8, grid=None,
+                      tti=None, rng=None):
+    '''
+    simulate_fire computed with frontier_steps, returns the same key frames
+    '''
+    key_frames = []
+    if grid is None or tti is None:
+        grid, tti = initialize_grid(ignite_cell, shape=shape, rng=rng)
+    grid = np.array(grid, dtype=float)
+    changes = frontier_steps(grid, tti, alpha, beta, gamma, steps, warn_threshold, rng)
+    for _ in range(1, steps):
+        ignited, warned = next(changes, (None, None))
+        if ignited is not None:
+            grid[ignited[:, 0], ignited[:, 1]] = 1
+            grid[warned[:, 0], warned[:, 1]] = 2
+        key_frames.append(grid.tolist())
+    return key_frames
+
+def _start(ignite_cell, shape, grid, tti, rng):
+    if grid is None or tti is None:
+        grid, tti = initialize_grid(ignite_cell, shape=shape, rng=rng)
+    return np.asarray(grid, dtype=np.int8), tti
+
+def iter_changes(grid, tti, alpha=1, beta=0.5, gamma=0.1, steps=50, warn_threshold=0.8, rng=None):
+    '''
+    Yields the list of [x, y, state] of the cells that changed in each step as it is
+    computed, up to the last step in which a cell can still change
+    grid: 2D start state
+    tti: 2D time to ignition of each cell
+    '''
+    for ignited, warned in frontier_steps(grid, tti, alpha, beta, gamma, steps, warn_threshold, rng):
+        changed = np.concatenate((np.column_stack((ignited, np.ones(len(ignited), dtype=int))),
+                                  np.column_stack((warned, np.full(len(warned), 2)))))
+        yield changed.tolist()
+
+def simulate_changes(ignite_cell, shape, alpha=1, beta=0.5, gamma=0.1, steps=50, warn_threshold=0.8, grid=None,
+                     tti=None, rng=None):
+    '''
+    Delta encoded simulate_fire, generated from frontier_steps without building any frame
+    Returns: the initial grid and, for every step up to the last one in which a cell
+    can still change, the list of [x, y, state] of the cells that changed in it.
+    Frame k of simulate_fire is the initial grid with the changes of the first k + 1 steps applied,
+    the frames after the last step all equal the last one
+    '''
+    grid, tti = _start(ignite_cell, shape, grid, tti, rng)
+    return grid, list(iter_changes(grid, tti, alpha, beta, gamma, steps, warn_threshold, rng))
+
+def simulate_ignition(ignite_cell, shape, alpha=1, beta=0.5, gamma=0.1, steps=50, warn_threshold=0.8, grid=None,
+                      tti=None, rng=None):
+    '''
+    simulate_fire compressed to one step per cell, generated from frontier_steps without building any frame
+    Returns: the initial grid, the step each cell starts burning and the step each cell becomes
+    a warning (0 for the initial grid, -1 for never), and the number of steps simulated
+    before the fire stopped changing
+    '''
+    grid, tti = _start(ignite_cell, shape, grid, tti, rng)
+    ignition = np.where(grid == 1, 0, -1)
+    warning = np.where(grid == 2, 0, -1)
+    step = 0
+    for step, (ignited, warned) in enumerate(frontier_steps(grid, tti, alpha, beta, gamma, steps, warn_threshold, rng),
+                                             start=1):
+        ignition[ignited[:, 0], ignited[:, 1]] = step
+        warning[warned[:, 0], warned[:, 1]] = step
+    return grid, ignition, warning, step
+
+def frames(ignite_cell, shape, alpha=1, beta=0.5, gamma=0.1, steps=50, warn_threshold=0.8, grid=None, tti=None,
+           rng=None):
+    '''
+    Yields the key frames of simulate_fire one at a time, as each step is computed
+    rng: numpy Generator to draw from, the global numpy random state by default
+    '''
+    if grid is None or tti is None:
+        grid, tti = initialize_grid(ignite_cell, shape=shape, rng=rng)
+    for _ in range(1, steps):
+        grid = update_grid(grid, tti, alpha, beta, gamma, warn_threshold, rng)
+        yield grid
+
+def simulate_fire(ignite_cell, shape, alpha=1, beta=0.5, gamma=0.1, steps=50, warn_threshold=0.8, grid=None, tti=None,
+                  rng=None):
     '''
     Each grid acts a key frame for the simulation
     ignite_cell: tuple of x, y coordinates of the cell to ignite
@@ -85,14 +276,75 @@ def simulate_fire(ignite_cell, shape, alpha=1, beta=0.5, gamma=0.1, steps=50, wa
     beta: hyperparameter, weight for farther active cells in spread_probability
     gamma: speed factor (resolution) for the spread of fire
     steps: number of steps to simulate/frames to generate
+    rng: numpy Generator drawing the time to ignition and every step, seed it to reproduce a run,
+    the global numpy random state by default
     Returns: an array of size steps containing the situation of gid at each step
 
     0 - not burning, 1 - burning, 2 - warning
     '''
-    key_frames = []
-    if grid is None or tti is None:
-        grid, tti = initialize_grid(ignite_cell, shape=shape)
-    for _ in range(1, steps):
-        grid = update_grid(grid, tti, alpha, beta, gamma, warn_threshold)
-        key_frames.append(grid.copy().tolist())
-    return key_frames
\ No newline at end of file
+    return [frame.tolist()
+            for frame in frames(ignite_cell, shape, alpha, beta, gamma, steps, warn_threshold, grid, tti, rng)]
+
+def forecast_ignition(grid, tti, alpha=1, beta=0.5, gamma=0.1, steps=50, warn_threshold=0.8):
+    '''
+    Runs the simulation from the current fire grid and returns its ignition steps
+    without keeping the frames, cells burning now get step 0
+    '''
+    grid = np.asarray(grid)
+    ignition = np.where(grid == 1, 0, -1)
+    changes = frontier_steps(grid, tti, alpha, beta, gamma, steps, warn_threshold)
+    for step, (ignited, _) in enumerate(changes, start=1):
+        ignition[ignited[:, 0], ignited[:, 1]] = step
+    return ignition
+
+cells_per_batch = 2**21   # realizations are stepped together in batches of about this many cells
+
+def _ensemble_ignition(ignite_cell, shape, realizations, alpha, beta, gamma, steps, warn_threshold, tti, seed):
+    '''
+    Ignition steps (realizations, rows, cols) of a group of realizations, -1 for never
+    '''
+    rng = np.random.default_rng(seed)
+    batch = max(1, cells_per_batch//(shape[0]*shape[1]))
+    ignition = np.full((realizations,) + tuple(shape), -1, dtype=np.int32)
+    for first in range(0, realizations, batch):
+        count = min(batch, realizations - first)
+        grid = np.zeros((count,) + tuple(shape), dtype=np.int8)
+        grid[:, ignite_cell[0], ignite_cell[1]] = 1
+        # each realization draws its own time to ignition, as initialize_grid does
+        batch_tti = rng.integers(1, max_tti, size=grid.shape) if tti is None else tti
+        arrival = ignition[first:first + count]
+        arrival[grid == 1] = 0
+        for step in range(1, steps):
+            grid = update_grid(grid, batch_tti, alpha, beta, gamma, warn_threshold, rng)
+            arrival[(arrival < 0) & (grid == 1)] = step
+    return ignition
+
+def ensemble(ignite_cell, shape, alpha=1, beta=0.5, gamma=0.1, steps=50, warn_threshold=0.8, realizations=100,
+             quantiles=(0.1, 0.5, 0.9), tti=None, seed=None, workers=None):
+    '''
+    Runs many realizations of simulate_fire at once and summarizes them per cell
+    realizations: number of independent runs
+    quantiles: arrival time quantiles to report
+    tti: 2D time to ignition shared by all runs, drawn per run when None
+    seed: seed of the runs, None for fresh entropy
+    workers: number of processes to split the runs over, None to run them in this process
+    Returns: probability, the share of runs in which each cell burns, and arrival,
+    one 2D array per quantile of the step each cell starts burning, the ignite cell
+    at step 0 and -1 where fewer runs than the quantile reach the cell
+    '''
+    shape = tuple(shape)
+    tti = None if tti is None else np.asarray(tti)
+    groups = workers or 1
+    sizes = [realizations//groups + (group < realizations%groups) for group in range(groups)]
+    seeds = np.random.SeedSequence(seed).spawn(groups)
+    jobs = [(ignite_cell, shape, size, alpha, beta, gamma, steps, warn_threshold, tti, group_seed)
+            for size, group_seed in zip(sizes, seeds) if size]
+    if workers:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            ignition = np.concatenate(list(pool.map(_ensemble_ignition, *zip(*jobs))))
+    else:
+        ignition = np.concatenate([_ensemble_ignition(*job) for job in jobs])
+    burns = ignition >= 0
+    arrival = np.quantile(np.where(burns, ignition, np.inf), quantiles, axis=0, method='inverted_cdf')
+    arrival = np.where(np.isinf(arrival), -1, arrival).astype(int)
+    return {'probability': burns.mean(axis=0), 'quantiles': list(quantiles), 'arrival': arrival}
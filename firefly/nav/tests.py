@@ -1,3 +1,224 @@
-from django.test import TestCase
+import datetime
+import heapq
+import itertools
+import math
+from collections import deque
+from types import SimpleNamespace
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase
+
+from . import PathFinder
+from . import alternatives
+from . import bitbfs
+from . import bundle
+from . import components
+from . import distance_field
+from . import evacuation
+from . import replanner
+
+def random_floor(rng, shape=(18, 24), walls=0.25, fires=0.05):
+    '''
+    Random grid, fire matrix, goal nodes and a safe entry
+    '''
+    grid = (rng.random(shape) >= walls).astype(int)
+    fire = (rng.random(shape) < fires).astype(int)
+    open_cells = np.argwhere((grid != 0) & (fire != 1)).tolist()
+    picks = rng.choice(len(open_cells), size=4, replace=False)
+    entry, *goals = [open_cells[pick] for pick in picks]
+    return grid, fire, goals, entry
+
+def cell_bfs(grid, goal_nodes, entry, fire):
+    '''
+    The cell by cell FIFO search _bfs replaced, returns its path
+    '''
+    goals = set(map(tuple, goal_nodes))
+    entry = tuple(entry)
+    queue = deque([entry])
+    parent = {entry: None}
+    while queue:
+        current = queue.popleft()
+        if current in goals:
+            path = []
+            while current is not None:
+                path.append(current)
+                current = parent[current]
+            return path[::-1]
+        for dx, dy in PathFinder.MOVES:
+            child = (current[0] + dx, current[1] + dy)
+            if PathFinder.is_safe(grid, child, fire) and child not in parent:
+                parent[child] = current
+                queue.append(child)
+    return []
+
+def shortest_length(grid, goal_nodes, entry, fire):
+    '''
+    Dijkstra over cells with 1 / sqrt(2) moves, inf if no goal is reachable
+    '''
+    goals = set(map(tuple, goal_nodes))
+    cost = {tuple(entry): 0.0}
+    heap = [(0.0, tuple(entry))]
+    while heap:
+        d, current = heapq.heappop(heap)
+        if d > cost[current]:
+            continue
+        if current in goals:
+            return d
+        for (dx, dy), step in zip(PathFinder.MOVES, PathFinder.MOVE_COSTS):
+            child = (current[0] + dx, current[1] + dy)
+            if PathFinder.is_safe(grid, child, fire) and d + step < cost.get(child, math.inf):
+                cost[child] = d + step
+                heapq.heappush(heap, (d + step, child))
+    return math.inf
+
+def path_length(path):
+    return sum(math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(path, path[1:]))
+
+def floors(count=20, seed=0):
+    rng = np.random.default_rng(seed)
+    return [random_floor(rng) for _ in range(count)]
+
+class SearchTests(SimpleTestCase):
+    def test_bfs_matches_cell_by_cell_search(self):
+        for grid, fire, goals, entry in floors():
+            parent, goal = PathFinder._bfs(grid, goals, entry, fire)
+            expected = cell_bfs(grid, goals, entry, fire)
+            if goal is None:
+                self.assertEqual(expected, [])
+            else:
+                self.assertEqual(PathFinder._get_path(parent, goal, grid.shape), expected)
+
+    def test_astar_and_jps_find_shortest_routes(self):
+        for grid, fire, goals, entry in floors():
+            expected = shortest_length(grid, goals, entry, fire)
+            for engine in (PathFinder._astar, PathFinder._jps):
+                parent, goal = engine(grid, goals, entry, fire)
+                if goal is None:
+                    self.assertEqual(expected, math.inf)
+                else:
+                    path = PathFinder._get_path(parent, goal, grid.shape)
+                    self.assertAlmostEqual(path_length(path), expected)
+                    self.assertEqual(path[0], tuple(entry))
+
+    def test_replanner_repair_matches_fresh_astar(self):
+        rng = np.random.default_rng(1)
+        for grid, fire, goals, entry in floors(10, seed=1):
+            shape = grid.shape
+            planner = replanner.Planner(PathFinder.padded_mask(grid, fire), shape,
+                                        [PathFinder.to_index(goal, shape) for goal in goals],
+                                        PathFinder.to_index(entry, shape))
+            path = planner.path()
+            self.assertAlmostEqual(path_length(path) if path else math.inf, shortest_length(grid, goals, entry, fire))
+            # the fire spreads over part of the route, away from the entry
+            spread = fire.copy()
+            for x, y in path[2:]:
+                if rng.random() < 0.3 and [x, y] not in goals:
+                    spread[x, y] = 1
+            planner.update(PathFinder.padded_mask(grid, spread), PathFinder.to_index(entry, shape))
+            parent, goal = PathFinder._astar(grid, goals, entry, spread)
+            repaired = planner.path()
+            if goal is None:
+                self.assertEqual(repaired, [])
+            else:
+                self.assertAlmostEqual(path_length(repaired),
+                                       path_length(PathFinder._get_path(parent, goal, shape)))
+
+class FieldTests(SimpleTestCase):
+    def test_distance_layers_match_build_field(self):
+        for grid, fire, goals, _ in floors():
+            field = distance_field.build_field(grid, goals, fire)
+            rows, cols = grid.shape
+            sources = np.zeros(grid.shape, dtype=bool)
+            sources[tuple(np.transpose(goals))] = True
+            sources &= fire != 1
+            dist = bitbfs.distance_layers((grid != 0) & (fire != 1), sources)
+            np.testing.assert_array_equal(dist, field.dist.reshape(rows + 2, cols + 2)[1:-1, 1:-1])
+
+    def test_labels_match_reachability(self):
+        for grid, fire, goals, entry in floors():
+            labels, count = components.label((grid != 0) & (fire != 1))
+            field = distance_field.build_field(grid, [entry], fire)
+            rows, cols = grid.shape
+            reached = field.dist.reshape(rows + 2, cols + 2)[1:-1, 1:-1] >= 0
+            np.testing.assert_array_equal(labels == labels[tuple(entry)], reached)
+            self.assertEqual(set(np.unique(labels)), set(range(count + 1)))
+            expected = [goal for goal in goals if reached[tuple(goal)]]
+            self.assertEqual(components.reachable_goals(labels, goals, entry), expected)
+
+    def test_bundle_decodes_to_the_fields(self):
+        grid, fire, goals, _ = floors(1, seed=2)[0]
+        fields = {method: distance_field.build_field(grid, goals[:i + 1], fire)
+                  for i, method in enumerate(PathFinder.METHODS)}
+        building = SimpleNamespace(updated_at=datetime.datetime(2024, 1, 1, 12, 0, 0, 250))
+        version = bundle.version(building, fire)
+        transform = PathFinder.georeference(grid.shape)
+        header, planes = bundle.unpack(bundle.pack(fields, transform, version))
+        self.assertEqual(header['shape'], grid.shape)
+        self.assertEqual(header['version'], version)
+        np.testing.assert_allclose(header['georeference'], transform)
+        rows, cols = grid.shape
+        for method, codes in zip(PathFinder.METHODS, planes):
+            dist = fields[method].dist.reshape(rows + 2, cols + 2)[1:-1, 1:-1]
+            for x, y in np.argwhere(dist > 0).tolist():
+                # following the codes from a cell reaches a goal in exactly dist moves
+                moves = dist[x, y]
+                while codes[x, y] != bundle.GOAL:
+                    dx, dy = PathFinder.MOVES[codes[x, y]]
+                    x, y = x + dx, y + dy
+                    moves -= 1
+                self.assertEqual(moves, 0)
+            np.testing.assert_array_equal(codes == bundle.NO_ROUTE, dist < 0)
+
+class AlternativesTests(SimpleTestCase):
+    def test_routes_around_a_ring_with_corridors(self):
+        # a ring 6 cells wide, a corridor from its top side to the top exit and one
+        # from its bottom side to the bottom exit, entered at its top left corner
+        grid = np.zeros((90, 52), dtype=int)
+        grid[40:46, 5:45] = grid[74:80, 5:45] = 1
+        grid[40:80, 5:11] = grid[40:80, 39:45] = 1
+        grid[:40, 24:27] = grid[80:, 24:27] = 1
+        exits = [[0, 25], [89, 25]]
+        field = distance_field.build_field(grid, exits)
+        routes = alternatives.routes(field, [41, 6], 3)
+        self.assertEqual(len(routes), 3)
+        self.assertEqual(len(set(map(tuple, routes))), 3)
+        for route in routes:
+            self.assertEqual(route[0], (41, 6))
+            self.assertIn(list(route[-1]), exits)
+            self.assertEqual(len(set(route)), len(route))
+            self.assertLessEqual(len(route) - 1, (1 + alternatives.stretch)*(len(routes[0]) - 1))
+        self.assertIn([89, 25], [list(route[-1]) for route in routes])
+
+class EvacuationTests(SimpleTestCase):
+    def test_assign_matches_brute_force(self):
+        rng = np.random.default_rng(3)
+        for _ in range(40):
+            occupants, exits = rng.integers(1, 7), rng.integers(1, 4)
+            cost = rng.integers(1, 30, size=(occupants, exits)).astype(float)
+            cost[rng.random(cost.shape) < 0.15] = math.inf
+            capacity = rng.integers(1, occupants + 1, size=exits)
+            if capacity.sum() < occupants:
+                capacity[0] += occupants - capacity.sum()
+            choice = evacuation.assign(cost, capacity)
+            reachable = np.isfinite(cost).any(axis=1)
+            self.assertEqual((choice >= 0).tolist(), reachable.tolist())
+            rows = np.flatnonzero(reachable)
+            best = min((cost[rows, list(option)].sum() for option in itertools.product(range(exits), repeat=rows.size)
+                        if (np.bincount(option, minlength=exits) <= capacity).all()), default=math.inf)
+            if math.isinf(best):
+                # the reachable exits cannot take everyone, capacities are scaled up instead
+                continue
+            self.assertTrue((np.bincount(choice[rows], minlength=exits) <= capacity).all())
+            self.assertAlmostEqual(cost[rows, choice[rows]].sum(), best)
+
+    def test_plan_without_exits(self):
+        fields = evacuation.build_fields(np.ones((6, 6), dtype=int), [], None)
+        exits, safe, paths = evacuation.plan(fields, [[1, 1], [2, 3], [9, 9]])
+        self.assertEqual(exits.tolist(), [-1, -1, -1])
+        self.assertEqual(safe.tolist(), [True, True, False])
+        self.assertEqual([path.shape for path in paths], [(0, 2)]*3)
+
+    def test_plan_defaults_to_the_nearest_exit(self):
+        fields = evacuation.build_fields(np.ones((6, 6), dtype=int), [[0, 0], [5, 5]], None)
+        exits, _, _ = evacuation.plan(fields, [[1, 1], [1, 2], [2, 1], [4, 4]])
+        self.assertEqual(exits.tolist(), [0, 0, 0, 1])
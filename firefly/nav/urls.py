@@ -4,6 +4,13 @@ from . import views
 urlpatterns = [
     path('test', views.test, name='test'),
     path('nav', views.navigate, name='nav'),
+    path('nav/batch', views.navigate_batch, name='nav_batch'),
+    path('nav/cache', views.route_cache_stats, name='nav_cache'),
+    path('nav/session', views.navigate_session, name='nav_session'),
+    path('nav/floors', views.navigate_floors, name='nav_floors'),
+    path('nav/evacuate', views.evacuate, name='nav_evacuate'),
+    path('nav/bundle', views.route_bundle, name='nav_bundle'),
     path('simulate', views.simulate, name='simulate'),
+    path('simulate/ensemble', views.simulate_ensemble, name='simulate_ensemble'),
     path('building', views.get_building, name='building'),
 ]
\ No newline at end of file
@@ -1,69 +1,416 @@
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
+from rest_framework.renderers import JSONRenderer
 from rest_framework import status
+from django.http import HttpResponse, StreamingHttpResponse
+import json
+import numpy as np
 
 from . import PathFinder
 from . import models
 from . import serializer
 from . import simulate_fire
+from . import distance_field
+from . import forecast
+from . import replanner
+from . import floors
+from . import hierarchy
+from . import maps
+from . import evacuation
+from . import bundle
+from . import components
+from . import alternatives
+from . import route_cache
+from . import cache
 from datetime import datetime
 
+max_realizations = 2000   # largest ensemble a request may ask for
+ensemble_workers = None   # processes an ensemble is split over, None runs it in the request
+frame_encodings = ('frames', 'delta', 'ignition')   # ways /simulate can return a run
+stream_formats = {'ndjson': 'application/x-ndjson', 'sse': 'text/event-stream'}   # content type of each stream
+# rendered JSON of seeded /simulate responses, grouped by grid shape
+simulations = cache.SnapshotCache(max_bytes=64*2**20, max_entry_bytes=8*2**20)
+
+def _entry(params, transform):
+    '''
+    Reads the user's cell from entry:"x,y" or, when it is missing, from
+    lonlat:"lon,lat" through the inverse of the building's georeference
+    '''
+    entry = params.get('entry')
+    if entry is not None:
+        entry = entry.split(',')
+        return [int(entry[0]), int(entry[1])]
+    lon, lat = (float(value) for value in params.get('lonlat').split(',')[:2])
+    return PathFinder.lon_lat_to_cells([lon, lat], transform).tolist()
+
 @api_view(['GET','POST'])
 def navigate(request):
     '''
     This function is used to navigate the user to the nearest fire exit, medical kit or extinguisher
     POST request:
-    grid: 2D array, goal_nodes: 2D array, entry: touple and fire: 2D array
+    grid: 2D array, goal_nodes: 2D array, entry: touple and fire: 2D array,
+    georeference: optional affine transform [a, b, c, d, e, f] of the grid
     GET request:
     send the id:int primary key of building,
     method:string method can be fire, med or extinguisher
-    entry:2D array ([x,y]) current location of the user
+    entry:2D array ([x,y]) current location of the user, or
+    lonlat:2D array ([lon,lat]) the same location in the building's coordinates
+    both requests take an optional mode:string, bfs (default), astar, jps, spacetime or risk,
+    GET requests also accept hierarchical for large floors (near shortest, precomputed per building)
+    spacetime mode avoids cells predicted to ignite before the user reaches them,
+    it takes ignition:2D array of ignition steps in POST requests or
+    horizon:int forecast steps (default 50) in GET requests,
+    and steps_per_move:float simulation steps needed to move one cell (default 1)
+    k:int optional, bfs mode only, number of diverse routes returned as paths:list, shortest first
+    GET responses also carry component:int, the connected area of the floor the user is in,
+    its component_size:int in cells, no_goals:bool, true when the floor has no goal of that method,
+    and trapped:bool, true when the floor has goals but walls or fire cut the user off from all of them
     '''
     if request.method == 'POST':
         grid = request.data.get('grid')
         goal_nodes = request.data.get('goal_nodes')
         entry = request.data.get('entry')
         fire = request.data.get('fire')
+        mode = request.data.get('mode', 'bfs')
+        ignition = request.data.get('ignition')
+        steps_per_move = request.data.get('steps_per_move', 1)
+        transform = request.data.get('georeference')
+        try:
+            k = int(request.data.get('k', 1))
+        except (TypeError, ValueError):
+            return Response({'error': 'k must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            path = PathFinder.path_finder(grid=grid, goal_nodes=goal_nodes, entry=entry, fire=fire)
+            path = PathFinder.path_finder(grid=grid, goal_nodes=goal_nodes, entry=entry, fire=fire, mode=mode,
+                                          ignition=ignition, steps_per_move=steps_per_move, transform=transform, k=k)
         except Exception as e:
             return Response({'error': str(e)})
-        res = {'path': path}
+        res = {'path': path} if k <= 1 else {'path': path[0] if path else [], 'paths': path}
         return Response(res)
 
     elif request.method == 'GET':
         id = request.query_params.get('id')
         method = request.query_params.get('method')
-        entry = request.query_params.get('entry')
-        if id is None or method is None or entry is None:
+        mode = request.query_params.get('mode', 'bfs')
+        paths = None
+        located = 'entry' in request.query_params or 'lonlat' in request.query_params
+        if id is None or method is None or not located:
             err = {'error': 'id and/or method and/or entry are missing in the request. id is needed to fetch the building data and method can be fire, med or extinguisher (string) depending on where the user wants to go'}
             return Response(err, status=status.HTTP_400_BAD_REQUEST)
-        entry = entry.split(',')
-        entry = [int(entry[0]), int(entry[1])]
+        # the snapshot is read without the arrays, repeated queries are answered from the route cache
+        version = route_cache.building_version(id)
+        if version is None:
+            err = {'error': 'Building with the given id does not exist'}
+            return Response(err, status=status.HTTP_404_NOT_FOUND)
+        route_cache.routes.snapshot(id, version)
+        query = route_cache.query_key(request.query_params)
+        cached = route_cache.routes.get(id, query)
+        if cached is not None:
+            return Response(cached, status=status.HTTP_200_OK)
         try:
             building = models.Building.objects.get(id=id)
         except models.Building.DoesNotExist:
             err = {'error': 'Building with the given id does not exist'}
             return Response(err, status=status.HTTP_404_NOT_FOUND)
-        grid = building.floor_map[0] # 0th floor
-        fire = building.fire_matrix[0] # 0th floor
-        grid, fire_exits, med_kits, extinguishers = PathFinder.map_handler(grid)
-        if method == 'fire':
-            goal_nodes = fire_exits
-        elif method == 'med':
-            goal_nodes = med_kits
-        elif method == 'extinguisher':
-            goal_nodes = extinguishers
-        else:
+        if method not in PathFinder.METHODS:
             err = {'error': 'Invalid method, method can be fire, med or extinguisher (string) depending on where the user wants to go'}
             return Response(err, status=status.HTTP_400_BAD_REQUEST)
+        fire = building.fire_matrix[0] # 0th floor
         try:
-            path = PathFinder.path_finder(grid=grid, goal_nodes=goal_nodes, entry = entry, fire= fire)
+            transform = maps.georeference(building, maps.building_map(building)[0].shape)
+            entry = _entry(request.query_params, transform)
+            k = int(request.query_params.get('k', 1))
+            grid, goal_nodes = maps.method_goals(building, method)
+            labels, sizes = components.building_labels(building, fire)
+            if not PathFinder.is_valid(grid, entry) or labels[tuple(entry)] == 0:
+                raise ValueError('Entry point is not safe')
+            component = int(labels[tuple(entry)])
+            no_goals = not goal_nodes
+            trapped = not no_goals and not components.reachable_goals(labels, goal_nodes, entry)
+            if no_goals or trapped:
+                # no goal on the floor or cut off from every goal by walls or fire, nothing to search
+                path = []
+            elif mode == 'bfs':
+                # the field is shared by every occupant until the building or its fire changes
+                field = distance_field.building_field(building, method, fire)
+                passable = PathFinder.unpad(field.passable, field.shape)
+                if k > 1:
+                    paths = [PathFinder.format_path(route, passable, transform)
+                             for route in alternatives.routes(field, entry, k)]
+                    path = paths[0] if paths else []
+                else:
+                    path = PathFinder.format_path(distance_field.walk(field, entry), passable, transform)
+            elif k > 1:
+                raise ValueError('Alternative routes are only available in bfs mode')
+            elif mode == 'hierarchical':
+                planner = hierarchy.building_hierarchy(building, method, fire)
+                path, passable = planner.route(entry, fire)
+                path = PathFinder.format_path(path, passable, transform)
+            else:
+                ignition = None
+                if mode == 'spacetime':
+                    horizon = int(request.query_params.get('horizon', 50))
+                    ignition = forecast.building_ignition(building, fire, steps=horizon)
+                steps_per_move = float(request.query_params.get('steps_per_move', 1))
+                path = PathFinder.path_finder(grid=grid, goal_nodes=goal_nodes, entry=entry, fire=fire, mode=mode,
+                                              ignition=ignition, steps_per_move=steps_per_move, transform=transform,
+                                              labels=labels)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        res = {'path': path}
+        res = {'path': path, 'component': component, 'component_size': int(sizes[component]),
+               'no_goals': no_goals, 'trapped': trapped}
+        if k > 1:
+            res['paths'] = paths or []
+        route_cache.routes.set(id, query, res, version)
         return Response(res, status=status.HTTP_200_OK)
 
+@api_view(['GET'])
+def route_cache_stats(request):
+    '''
+    This function is used to monitor the cache of GET /nav responses
+    Returns entries, bytes, max_bytes, hits, misses and hit_rate
+    '''
+    return Response(route_cache.routes.stats(), status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+def navigate_batch(request):
+    '''
+    This function is used to navigate many users of the same building in one request
+    POST request:
+    id:int primary key of building
+    entries:list of [x,y] current locations of the users, or
+    points:list of [lon,lat] locations in the building's coordinates
+    method:string fire, med or extinguisher applied to every entry, or
+    methods:list of methods, one per entry
+    Returns paths:list with {'path': path} or {'error': message} for each entry
+    '''
+    id = request.data.get('id')
+    entries = request.data.get('entries')
+    points = request.data.get('points')
+    methods = request.data.get('methods')
+    if entries is None and points:
+        entries = points
+    if methods is None and entries is not None:
+        methods = [request.data.get('method')]*len(entries)
+    if id is None or entries is None:
+        err = {'error': 'id and entries are required, with a method for all entries or a list of methods, one per entry'}
+        return Response(err, status=status.HTTP_400_BAD_REQUEST)
+    if len(methods) != len(entries):
+        err = {'error': 'methods must contain one method per entry'}
+        return Response(err, status=status.HTTP_400_BAD_REQUEST)
+    if any(method not in PathFinder.METHODS for method in methods):
+        err = {'error': 'Invalid method, method can be fire, med or extinguisher (string) depending on where the user wants to go'}
+        return Response(err, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        building = models.Building.objects.get(id=id)
+    except models.Building.DoesNotExist:
+        err = {'error': 'Building with the given id does not exist'}
+        return Response(err, status=status.HTTP_404_NOT_FOUND)
+    fire = building.fire_matrix[0] # 0th floor
+    fields = distance_field.building_fields(building, methods, fire)
+    transform = maps.georeference(building, maps.building_map(building)[0].shape)
+    if entries is points:
+        # every point converted to its cell in one call
+        try:
+            entries = PathFinder.lon_lat_to_cells(points, transform).tolist()
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    paths = []
+    for entry, method in zip(entries, methods):
+        field = fields[method]
+        passable = PathFinder.unpad(field.passable, field.shape)
+        try:
+            path = PathFinder.format_path(distance_field.walk(field, [int(entry[0]), int(entry[1])]), passable, transform)
+        except Exception as e:
+            paths.append({'error': str(e)})
+            continue
+        paths.append({'path': path})
+    return Response({'paths': paths}, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+def evacuate(request):
+    '''
+    This function is used to evacuate every occupant of a building at once without crowding one exit
+    POST request:
+    id:int primary key of building
+    entries:list of [x,y] locations of the occupants, or
+    points:list of [lon,lat] locations in the building's coordinates
+    method:string optional, fire (default), med or extinguisher
+    capacity:int or list optional, occupants each exit can take, one number for all
+    exits or one per exit in the order of exits, by default unbounded (nearest exit)
+    Returns exits:list of [x,y] exits, load:list of occupants sent to each exit and
+    paths:list with {'exit': index, 'path': path} or {'error': message} for each occupant,
+    paths only keep the points where they turn
+    '''
+    id = request.data.get('id')
+    entries = request.data.get('entries')
+    points = request.data.get('points')
+    method = request.data.get('method', 'fire')
+    capacity = request.data.get('capacity')
+    if id is None or (entries is None and points is None):
+        err = {'error': 'id and entries (or points) are required'}
+        return Response(err, status=status.HTTP_400_BAD_REQUEST)
+    if method not in PathFinder.METHODS:
+        err = {'error': 'Invalid method, method can be fire, med or extinguisher (string) depending on where the user wants to go'}
+        return Response(err, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        building = models.Building.objects.get(id=id)
+    except models.Building.DoesNotExist:
+        err = {'error': 'Building with the given id does not exist'}
+        return Response(err, status=status.HTTP_404_NOT_FOUND)
+    fire = building.fire_matrix[0] # 0th floor
+    try:
+        fields = evacuation.building_fields(building, method, fire)
+        transform = maps.georeference(building, fields.shape)
+        if entries is None:
+            entries = PathFinder.lon_lat_to_cells(points, transform)
+        exits, safe, cells = evacuation.plan(fields, entries, capacity)
+        # every path converted in one call, then split per occupant
+        lengths = [len(path) for path in cells]
+        points = PathFinder.cells_to_lon_lat(np.concatenate(cells + [np.empty((0, 2))]), transform).tolist()
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    paths, start = [], 0
+    for exit, ok, length in zip(exits.tolist(), safe.tolist(), lengths):
+        if ok:
+            paths.append({'exit': exit, 'path': points[start:start + length]})
+        else:
+            paths.append({'error': 'Entry point is not safe'})
+        start += length
+    load = np.bincount(exits[exits >= 0], minlength=len(fields.goals)).tolist()
+    return Response({'exits': fields.goals, 'load': load, 'paths': paths}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+def route_bundle(request):
+    '''
+    This function is used to download the next hop tables of a building for routing on the client
+    GET request:
+    id:int primary key of building
+    version:string optional, version of the bundle the client already has
+    (the If-None-Match header is honoured as well)
+    Returns the binary bundle described in bundle.py with its version as ETag,
+    or 304 when the client's version is still current
+    '''
+    id = request.query_params.get('id')
+    if id is None:
+        err = {'error': 'id is required to fetch the building data'}
+        return Response(err, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        building = models.Building.objects.get(id=id)
+    except models.Building.DoesNotExist:
+        err = {'error': 'Building with the given id does not exist'}
+        return Response(err, status=status.HTTP_404_NOT_FOUND)
+    fire = building.fire_matrix[0] # 0th floor
+    known = request.query_params.get('version') or request.headers.get('If-None-Match', '').strip('"')
+    try:
+        if known and known == bundle.version(building, fire):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            known, data = bundle.building_bundle(building, fire)
+            response = HttpResponse(data, content_type='application/octet-stream')
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    response['ETag'] = f'"{known}"'
+    return response
+
+@api_view(['GET'])
+def navigate_session(request):
+    '''
+    This function is used to keep navigating a user whose location and fire surroundings keep changing
+    GET request:
+    id:int primary key of building
+    method:string fire, med or extinguisher
+    entry:2D array ([x,y]) current location of the user, or lonlat:2D array ([lon,lat])
+    session:string optional, id returned by the previous call of this user
+    The previous search of the session is repaired instead of searching from scratch,
+    the response carries the session id to send with the next call
+    '''
+    id = request.query_params.get('id')
+    method = request.query_params.get('method')
+    session = request.query_params.get('session')
+    located = 'entry' in request.query_params or 'lonlat' in request.query_params
+    if id is None or method is None or not located:
+        err = {'error': 'id and/or method and/or entry are missing in the request. id is needed to fetch the building data and method can be fire, med or extinguisher (string) depending on where the user wants to go'}
+        return Response(err, status=status.HTTP_400_BAD_REQUEST)
+    if method not in PathFinder.METHODS:
+        err = {'error': 'Invalid method, method can be fire, med or extinguisher (string) depending on where the user wants to go'}
+        return Response(err, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        building = models.Building.objects.get(id=id)
+    except models.Building.DoesNotExist:
+        err = {'error': 'Building with the given id does not exist'}
+        return Response(err, status=status.HTTP_404_NOT_FOUND)
+    fire = building.fire_matrix[0] # 0th floor
+    try:
+        transform = maps.georeference(building, maps.building_map(building)[0].shape)
+        entry = _entry(request.query_params, transform)
+        session, path, passable = replanner.session_path(session, building, method, fire, entry)
+        path = PathFinder.format_path(path, passable, transform)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'session': session, 'path': path}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+def navigate_floors(request):
+    '''
+    This function is used to navigate the user across all the floors of the building
+    GET request:
+    id:int primary key of building
+    method:string fire, med or extinguisher
+    entry:3D array ([floor,x,y]) current location of the user
+    elevators:string optional, true to allow elevators (cells 6) besides stairs (cells 5)
+    Returns path:list of {'floor': floor, 'path': path} segments in walking order
+    '''
+    id = request.query_params.get('id')
+    method = request.query_params.get('method')
+    entry = request.query_params.get('entry')
+    use_elevators = request.query_params.get('elevators', 'false').lower() == 'true'
+    if id is None or method is None or entry is None:
+        err = {'error': 'id and/or method and/or entry are missing in the request. id is needed to fetch the building data and method can be fire, med or extinguisher (string) depending on where the user wants to go'}
+        return Response(err, status=status.HTTP_400_BAD_REQUEST)
+    if method not in PathFinder.METHODS:
+        err = {'error': 'Invalid method, method can be fire, med or extinguisher (string) depending on where the user wants to go'}
+        return Response(err, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        building = models.Building.objects.get(id=id)
+    except models.Building.DoesNotExist:
+        err = {'error': 'Building with the given id does not exist'}
+        return Response(err, status=status.HTTP_404_NOT_FOUND)
+    try:
+        entry = [int(value) for value in entry.split(',')[:3]]
+        path, passable = floors.route(building.floor_map, building.fire_matrix, entry, method, use_elevators)
+        transform = maps.georeference(building, passable.shape[1:])
+        path = floors.floor_segments(path, passable, transform)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'path': path}, status=status.HTTP_200_OK)
+
+def _simulation_records(encoding, grid, tti, alpha, beta, gamma, steps, warn_threshold, rng):
+    '''
+    Records of a streamed simulation: the initial grid, one record per step as it is
+    computed, and a last one with the number of steps simulated
+    '''
+    yield {'initial': grid.astype(int).tolist()}
+    step = 0
+    try:
+        if encoding == 'delta':
+            changes = simulate_fire.iter_changes(grid, tti, alpha, beta, gamma, steps, warn_threshold, rng)
+            for step, changed in enumerate(changes, start=1):
+                yield {'step': step, 'changes': changed}
+        else:
+            frames = simulate_fire.frames(None, grid.shape, alpha, beta, gamma, steps, warn_threshold, grid, tti, rng)
+            for step, frame in enumerate(frames, start=1):
+                yield {'step': step, 'grid': frame.tolist()}
+    except Exception as e:
+        # the status line is already sent, the error ends the stream instead
+        yield {'error': str(e)}
+        return
+    yield {'done': True, 'steps': step}
+
+def _stream(records, stream):
+    for record in records:
+        data = json.dumps(record)
+        yield f'data: {data}\n\n' if stream == 'sse' else data + '\n'
+
 @api_view(['POST'])
 def simulate(requests):
     '''
@@ -74,6 +421,16 @@ def simulate(requests):
     steps:int number of keyframes
     alpha, beta, gamma: optional hypermeters,  range(0,1)
     warn_threshold:float threshold for warning, range(0,1)
+    encoding:str optional, how the run is returned
+        frames (default) - grid: one full grid per step
+        delta - initial: the starting grid, changes: per step list of [x, y, state] of the cells that changed
+        ignition - initial: the starting grid, ignition and warning: 2D arrays of the step each cell
+                   starts burning or becomes a warning, -1 for never
+        delta and ignition stop early once the fire can no longer change, steps is the number simulated
+    stream:str optional, ndjson or sse to send frames or delta records as they are computed, one JSON
+        record per line or per server sent event: {initial}, then {step, grid} or {step, changes}
+        for every step, then {done, steps}
+    seed:int optional, makes the run reproducible, seeded runs are served from a cache once computed
     '''
     ignite_cell = requests.data.get('ignite_cell')
     shape = requests.data.get('shape')
@@ -89,16 +446,97 @@ def simulate(requests):
     beta = 0.5 if beta is None else beta
     gamma = 0.1 if gamma is None else gamma
     warn_threshold = 0.8 if warn_threshold is None else warn_threshold
-    cache = {}
-    if f'{ignite_cell}{shape}{steps}' in cache:
-        key_frames = cache[(ignite_cell, shape, steps)]
-        return Response({'key_frames': key_frames})
-    else:
+    encoding = requests.data.get('encoding', 'frames')
+    if encoding not in frame_encodings:
+        err = {'error': f'encoding must be one of {", ".join(frame_encodings)}'}
+        return Response(err, status=status.HTTP_400_BAD_REQUEST)
+    seed = requests.data.get('seed')
+    stream = requests.data.get('stream')
+    if stream is not None:
+        if stream not in stream_formats:
+            err = {'error': f'stream must be one of {", ".join(stream_formats)}'}
+            return Response(err, status=status.HTTP_400_BAD_REQUEST)
+        if encoding == 'ignition':
+            err = {'error': 'ignition encoding needs the whole run, stream frames or delta instead'}
+            return Response(err, status=status.HTTP_400_BAD_REQUEST)
         try:
-            key_frames = simulate_fire.simulate_fire(ignite_cell, shape, alpha, beta, gamma, steps)
+            steps = int(steps)
+            alpha, beta, gamma, warn_threshold = float(alpha), float(beta), float(gamma), float(warn_threshold)
+            rng = np.random.default_rng(None if seed is None else int(seed))
+            grid, tti = simulate_fire.initialize_grid(ignite_cell, shape=tuple(shape), rng=rng)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-    return Response({'grid': key_frames})
+        records = _simulation_records(encoding, grid, tti, alpha, beta, gamma, steps, warn_threshold, rng)
+        response = StreamingHttpResponse(_stream(records, stream), content_type=stream_formats[stream])
+        response['Cache-Control'] = 'no-cache'
+        return response
+    try:
+        steps = int(steps)
+        key = None
+        if seed is not None:
+            # only seeded runs are repeatable, unseeded ones are fresh draws every time
+            seed = int(seed)
+            key = (tuple(ignite_cell), float(alpha), float(beta), float(gamma), float(warn_threshold), steps, seed,
+                   encoding)
+            body = simulations.get(tuple(shape), key)
+            if body is not None:
+                return HttpResponse(body, content_type='application/json')
+        rng = np.random.default_rng(seed)
+        if encoding == 'delta':
+            initial, changes = simulate_fire.simulate_changes(ignite_cell, shape, alpha, beta, gamma, steps,
+                                                              warn_threshold, rng=rng)
+            res = {'initial': initial.tolist(), 'changes': changes, 'steps': len(changes)}
+        elif encoding == 'ignition':
+            initial, ignition, warning, simulated = simulate_fire.simulate_ignition(ignite_cell, shape, alpha, beta,
+                                                                                    gamma, steps, warn_threshold, rng=rng)
+            res = {'initial': initial.tolist(), 'ignition': ignition.tolist(), 'warning': warning.tolist(),
+                   'steps': simulated}
+        else:
+            res = {'grid': simulate_fire.simulate_fire(ignite_cell, shape, alpha, beta, gamma, steps, warn_threshold,
+                                                       rng=rng)}
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if key is None:
+        return Response(res, status=status.HTTP_200_OK)
+    # cached as the rendered bytes, sized in O(1) and served without rendering again
+    body = JSONRenderer().render(res)
+    simulations.set(tuple(shape), key, body)
+    return HttpResponse(body, content_type='application/json')
+
+@api_view(['POST'])
+def simulate_ensemble(request):
+    '''
+    This function is used to estimate where and when the fire is likely to spread from many simulations
+    POST request:
+    ignite_cell:2D array ([x,y]) coordinates of the cell to ignite
+    shape:2D array ([rows, cols]) shape of the grid
+    steps:int number of steps of each simulation
+    realizations:int optional, number of simulations (default 100)
+    quantiles:list optional, arrival time quantiles (default [0.1, 0.5, 0.9])
+    seed:int optional, makes the estimate reproducible
+    alpha, beta, gamma, warn_threshold: optional as in simulate
+    Returns probability:2D array, share of the simulations in which each cell burns, and
+    arrival:list of 2D arrays, the step each cell starts burning at each quantile, -1 if not reached
+    '''
+    ignite_cell = request.data.get('ignite_cell')
+    shape = request.data.get('shape')
+    steps = request.data.get('steps')
+    if ignite_cell is None or shape is None or steps is None:
+        err = {'error': 'ignite_cell, shape, steps are required parameters'}
+        return Response(err, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        realizations = int(request.data.get('realizations', 100))
+        if not 0 < realizations <= max_realizations:
+            raise ValueError(f'realizations must be between 1 and {max_realizations}')
+        result = simulate_fire.ensemble(ignite_cell, shape, request.data.get('alpha', 1), request.data.get('beta', 0.5),
+                                        request.data.get('gamma', 0.1), int(steps), request.data.get('warn_threshold', 0.8),
+                                        realizations, request.data.get('quantiles', (0.1, 0.5, 0.9)),
+                                        seed=request.data.get('seed'), workers=ensemble_workers)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    res = {'probability': result['probability'].round(4).tolist(), 'quantiles': result['quantiles'],
+           'arrival': result['arrival'].tolist()}
+    return Response(res, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 def get_building(request):